@@ -0,0 +1,129 @@
+from __future__ import print_function
+
+from general_functions import *
+from diamond_square_algo_alt import DiamondSquareGenerator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import os
+
+class BatchResult():
+
+    def __init__(self, shm, maps, paths):
+        '''
+        Holds the maps from generate_batch, they live in one shared memory block until close is called
+        @param shm: The SharedMemory block the maps are in, None if the maps weren't kept
+        @param maps: The maps in the same order as the specs, views into shm
+        @param paths: The paths of the saved PNGs in the same order as the specs, None if they weren't saved
+        '''
+        self.shm = shm
+        self.maps = maps
+        self.paths = paths
+
+    def close(self):
+        '''
+        Frees the shared memory, copy any maps that are still needed before calling this
+        '''
+        self.maps = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def map_shape(size):
+    '''
+    @param size: The size of a spec, a number for a square map or a (width, height) pair
+    @return: Returns the (height, width) shape of its map
+    '''
+    width, height = size if isinstance(size, (tuple, list)) else (size, size)
+    return height, width
+
+def generate_batch(specs, max_workers=None, output_dir=None, keep_maps=True, dtype=np.float64):
+    '''
+    Generates many Diamond Square maps across a pool of processes
+    The workers write straight into one shared memory block so the maps never get pickled
+    @param specs: A list of (seed, size, min_val, max_val, roughness) tuples, size is a number or a (width, height) pair
+    @param max_workers: How many processes to use, defaults to the number of cores
+    @param output_dir: If given every map is also saved here as a PNG by the worker as soon as it is done
+    @param keep_maps: Whether to return the maps, turn off to only save the PNGs
+    @param dtype: The dtype of the maps, np.float32 halves the memory
+    @return: Returns a BatchResult, use it as a context manager or call close when done with the maps
+    '''
+    specs = [tuple(spec) for spec in specs]
+
+    # Every map gets its own section of the shared block
+    shapes = [map_shape(spec[1]) for spec in specs]
+    offsets = []
+    total = 0
+    for height, width in shapes:
+        offsets.append(total)
+        total += height * width * np.dtype(dtype).itemsize
+
+    shm = None
+    maps = None
+    if keep_maps:
+        shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+        maps = [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset) for shape, offset in zip(shapes, offsets)]
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    paths = [None] * len(specs)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            shm_name = shm.name if shm is not None else None
+            futures = [pool.submit(generate_batch_item, shm_name, offset, spec, index, output_dir, dtype)
+                       for index, (spec, offset) in enumerate(zip(specs, offsets))]
+            for future in as_completed(futures):
+                index, path = future.result()
+                paths[index] = path
+    except:
+        maps = None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        raise
+
+    return BatchResult(shm, maps, paths)
+
+def generate_batch_item(shm_name, offset, spec, index, output_dir, dtype=np.float64):
+    '''
+    Generates one map of a batch inside of a worker process
+    @param shm_name: The name of the shared memory block to write the map into, None to not keep it
+    @param offset: Where the map starts in the shared memory block
+    @param spec: The (seed, size, min_val, max_val, roughness) of the map
+    @param index: The index of the spec in the batch
+    @param output_dir: The directory to save the PNG to, None to not save it
+    @param dtype: The dtype of the map
+    @return: Returns the index and the path of the PNG
+    '''
+    seed, size, min_val, max_val, roughness = spec
+    shm = None
+    out = dsg = None
+    try:
+        if shm_name is not None:
+            # The map is generated right in its section of the shared block, it is never made anywhere else first
+            shm = shared_memory.SharedMemory(name=shm_name)
+            out = np.ndarray(map_shape(size), dtype=dtype, buffer=shm.buf, offset=offset)
+        dsg = DiamondSquareGenerator(seed, size, min_val, max_val, roughness, engine='numpy', dtype=dtype, store=out)
+
+        path = None
+        if output_dir is not None:
+            path = os.path.join(output_dir, "map_%05d.png" % index)
+            cv2.imwrite(path, quantize(dsg.output, min_val, max_val))
+    finally:
+        if shm is not None:
+            # The views have to be gone before the block can be closed
+            dsg = out = None
+            shm.close()
+    return index, path
+
+if __name__ == '__main__':
+    specs = [(seed, 513, 0, 255, .4) for seed in range(32)]
+    with generate_batch(specs) as result:
+        display_image("Batch", quantize(result.maps[0], 0, 255))
@@ -0,0 +1,223 @@
+from __future__ import print_function
+
+from general_functions import *
+from diamond_square_algo_alt import DiamondSquareGenerator
+from diamond_square_algo_recursivev2 import DiamondSquareMap
+from semi_random_noise import generate2d
+from random_stuff import TowerMaker
+from random_lines import RandomPathGen
+from dungeon_gen import DungeonGenerator
+import multiprocessing
+import argparse
+import platform
+import tracemalloc
+import json
+import time
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Peak RSS isn't recorded where there is no resource module (Windows)
+    resource = None
+
+# The sizes every case is run at unless others are given, the Diamond Square ones need 2^n + 1
+DEFAULT_SIZES = (65, 257, 1025, 4097)
+
+def bench_diamond_square(engine):
+    def run(size, seed):
+        DiamondSquareGenerator(seed, size, 0, 255, .4, engine=engine)
+    return run
+
+def bench_diamond_square_map(engine):
+    def run(size, seed):
+        DiamondSquareMap(size, 0, 255, seed=seed, engine=engine).generate_map()
+    return run
+
+def bench_generate2d(size, seed):
+    generate2d(size, 100, 255, rng=seed)
+
+def bench_tower(engine):
+    def run(size, seed):
+        TowerMaker(size, 5, seed=seed, engine=engine)
+    return run
+
+def bench_random_path(size, seed):
+    gen = RandomPathGen(size, seed=seed)
+    gen.draw_line()
+    # A walker on every 16th cell of the top row, they keep going until they are all stuck
+    gen.draw_walks([(u, 0) for u in range(1, size, 16)])
+
+def bench_random_walk(size, seed):
+    RandomPathGen(size, seed=seed).draw_random_walk((0, 0), size * size)
+
+def bench_dungeon(size, seed):
+    # About one room for every 3000 tiles, 5000 rooms at 4096 x 4096
+    DungeonGenerator(size, size, seed=seed, max_rooms=max(1, size * size // 3355)).generate()
+
+# Every case is (name, function, largest size), the python loop engines are only run on the small sizes
+CASES = (
+    ('diamond_square_loop', bench_diamond_square('loop'), 257),
+    ('diamond_square_numpy', bench_diamond_square('numpy'), None),
+    ('diamond_square_block', bench_diamond_square('block'), None),
+    ('diamond_square_map_recursive', bench_diamond_square_map('recursive'), 257),
+    ('diamond_square_map_iterative', bench_diamond_square_map('iterative'), None),
+    ('generate2d', bench_generate2d, None),
+    ('tower_loop', bench_tower('loop'), 257),
+    ('tower_numpy', bench_tower('numpy'), None),
+    ('random_path', bench_random_path, None),
+    ('random_walk', bench_random_walk, None),
+    ('dungeon', bench_dungeon, None),
+)
+
+def peak_rss():
+    '''
+    @return: Returns the peak resident memory of this process in bytes, None if it can't be found
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def measure(name, size, repeat, seed):
+    '''
+    Runs one case at one size, it is meant to be run in a fresh process so the peak RSS only covers this case
+    The timed runs go first since tracemalloc slows down allocations, then one more run is traced
+    @param name: The name of the case
+    @param size: The size to run it at
+    @param repeat: How many timed runs to do, the fastest one is the wall time
+    @param seed: The seed to pass to the generator
+    @return: Returns a dict with the results
+    '''
+    run = dict((case[0], case[1]) for case in CASES)[name]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(size, seed)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(size, seed)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'case': name,
+        'size': size,
+        'wall_time': min(times),
+        'wall_times': times,
+        'peak_alloc': peak,
+        'peak_rss': peak_rss(),
+    }
+
+def run_benchmarks(cases=None, sizes=DEFAULT_SIZES, repeat=3, seed=0, all_sizes=False, log=None):
+    '''
+    Runs every case at every size, each one in its own process
+    @param cases: The names of the cases to run, None for all of them
+    @param sizes: The sizes to run them at
+    @param repeat: How many timed runs to do for each case and size
+    @param seed: The seed to pass to the generators
+    @param all_sizes: Whether to also run the loop engines past their largest size
+    @param log: A function that gets a line of text after every result, nothing is shown by default
+    @return: Returns a dict with the machine info and a list of results
+    '''
+    names = [case[0] for case in CASES]
+    if cases is None:
+        cases = names
+    for name in cases:
+        if name not in names:
+            raise Exception("Benchmark Error: There is no case named '%s'" % name)
+    limits = dict((case[0], case[2]) for case in CASES)
+
+    results = []
+    for name in cases:
+        for size in sizes:
+            if not all_sizes and limits[name] is not None and size > limits[name]:
+                continue
+            # A new process for every result, maxtasksperchild keeps the peak RSS from carrying over
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                result = pool.apply(measure, (name, size, repeat, seed))
+            finally:
+                pool.close()
+                pool.join()
+            results.append(result)
+            if log is not None:
+                log("%-30s %5d  %9.4fs  alloc %8.1f MB" % (name, size, result['wall_time'], result['peak_alloc'] / 2.0**20))
+
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+def compare(report, baseline, threshold=0.2, keys=('wall_time', 'peak_alloc'), min_time=0.01):
+    '''
+    Compares a report against a baseline report, only the results in both are compared
+    @param report: The report from run_benchmarks
+    @param baseline: An older report to compare against
+    @param threshold: How much bigger a value can get before it counts as a regression, .2 is 20%
+    @param keys: The values of every result to compare
+    @param min_time: Wall times that are both under this many seconds are too noisy to compare
+    @return: Returns a list of (case, size, key, baseline value, new value) for every regression
+    '''
+    old = dict(((r['case'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    for result in report['results']:
+        before = old.get((result['case'], result['size']))
+        if before is None:
+            continue
+        for key in keys:
+            if before.get(key) is None or result.get(key) is None:
+                continue
+            if key == 'wall_time' and max(before[key], result[key]) < min_time:
+                continue
+            if result[key] > before[key] * (1 + threshold):
+                regressions.append((result['case'], result['size'], key, before[key], result[key]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times every generator across a sweep of sizes")
+    parser.add_argument('--cases', nargs='+', help="The cases to run, all of them by default")
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES), help="The sizes to run every case at")
+    parser.add_argument('--repeat', type=int, default=3, help="How many timed runs to do, the fastest is kept")
+    parser.add_argument('--seed', type=int, default=0, help="The seed to pass to the generators")
+    parser.add_argument('--all-sizes', action='store_true', help="Also run the slow loop engines at the big sizes")
+    parser.add_argument('--output', help="Where to write the JSON report, it is printed when not given")
+    parser.add_argument('--baseline', help="A JSON report to compare against, a regression makes the exit code 1")
+    parser.add_argument('--threshold', type=float, default=0.2, help="How much slower or bigger counts as a regression")
+    parser.add_argument('--list', action='store_true', help="List the cases and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, run, limit in CASES:
+            print(name)
+        return 0
+
+    def log(line):
+        print(line, file=sys.stderr)
+
+    report = run_benchmarks(args.cases, args.sizes, args.repeat, args.seed, args.all_sizes, log)
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for case, size, key, before, after in regressions:
+            log("Regression: %s at %d, %s went from %g to %g" % (case, size, key, before, after))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,39 @@
 from __future__ import print_function
 
 from general_functions import *
+from diamond_square_plan import get_level_plan, level_for_distance, iter_bands, is_square_size, get_axis_plan
+from diamond_square_lod import corner_grid, refine_levels
+from diamond_square_parallel import generate_parallel, shared_map
+from progress import NULL_OBSERVER
 import numpy as np
 import random
 import math
 import calendar
 import time
 
-class DiamondSquareGenerator():
+class DiamondSquareGenerator(BaseGenerator):
     
-    def __init__(self, seed, size, min_val, max_val, roughness):
+    def __init__(self, seed, size, min_val, max_val, roughness, engine='loop', border=None, dtype=np.float64, store=None, observer=None, cache=None, lazy=False, workers=1):
         '''
         Constructor for the DiamondSquareGenerator class
         @param seed: The seed for the random generation
-        @param size: The square size of the height map
+        @param size: The square size of the height map, or a (width, height) pair for a map of any size. Only the 'numpy'
+                     engine makes maps that aren't 2^n + 1 square, it splits every gap of the map in the middle
+                     until they are all filled so the work and memory only grow with the area of the map
         @param min_val: The minimum value of the height map
         @param max_val: The maximum value of the height map
         @param roughness: Value between 1 and 0 reflects the smoothness between cells
+        @param engine: 'loop' to step through every point in python, 'numpy' to do each level as whole array operations,
+                       'block' to do the same with random values that are keyed by where they are, which lets the map be
+                       generated a level at a time and any part of it be refined on its own (see iter_levels and refine)
+        @param border: Optional (top, bottom, left, right) rows/columns of the map that are kept as they are instead of generated
+        @param dtype: The dtype of the output, np.float32 halves the memory
+        @param store: Where to keep the output, None for memory, a file path to memory map or an existing array to fill
+        @param observer: A ProgressObserver that gets told about every finished level, nothing is reported by default
+        @param cache: An OutputCache to take the map from when it was generated before, None to always generate
+        @param lazy: Whether to wait until the output is asked for to generate the map, it's generated right away by default
+        @param workers: How many processes the block engine splits every level across, the map is the same for any number.
+                        With more than one the in memory map is made in shared memory the workers write straight into
         '''
         # Adjust roughness into the acceptable range
         if roughness >= 1:
@@ -24,152 +41,384 @@ class DiamondSquareGenerator():
         elif roughness < 0:
             roughness = 0
         
+        if engine not in ('loop', 'numpy', 'block'):
+            raise Exception("Engine Error: It must be 'loop', 'numpy' or 'block'")
+        
         # Make sure the size is valid
-        if (size - 1) % 2 != 0:
-            raise Exception("Size Error: It must follow 'size = 2^n + 1'")
+        width, height = size if isinstance(size, (tuple, list)) else (size, size)
+        if width < 2 or height < 2:
+            raise Exception("Size Error: The map must be at least 2 points wide and high")
+        square = width == height and is_square_size(width)
+        if not square and engine != 'numpy':
+            raise Exception("Size Error: It must follow 'size = 2^n + 1' for the '" + engine + "' engine, only the 'numpy' engine makes other sizes")
+        
+        if workers > 1 and engine != 'block':
+            raise Exception("Engine Error: Only the 'block' engine can use more than one worker")
+        
+        if border is not None and (len(border[0]) != width or len(border[1]) != width or len(border[2]) != height or len(border[3]) != height):
+            raise Exception("Border Error: The top and bottom of the border must have 'width' values and the sides 'height' values")
+        
+        BaseGenerator.__init__(self, seed, {'size': size, 'min_val': min_val, 'max_val': max_val, 'roughness': roughness,
+                                            'engine': engine, 'border': border, 'dtype': np.dtype(dtype).str}, cache, store)
         
-        # Seed the random number generator
-        random.seed(seed)
+        # Every generator has its own random number generator so they don't share state with each other
+        # The numpy engine draws whole batches from self.rng, the loop engine single values from self.draws
+        self.rng = make_rng(seed)
+        self.draws = RandomBlock(self.rng)
         
-        # Save the parameters
-        self.size = size
+        # The block engine doesn't draw from self.rng, its random values come from blocks keyed by this seed
+        if engine == 'block':
+            if seed is None or isinstance(seed, np.random.Generator):
+                self.block_seed = int(self.rng.integers(2**63))
+            else:
+                self.block_seed = seed_to_int(seed)
+        
+        # Save the parameters, size stays a number for square maps
+        self.size = width if width == height else (width, height)
+        self.width = width
+        self.height = height
+        self.square = square
         self.min_val = min_val
         self.max_val = max_val
         self.roughness = roughness
+        self.engine = engine
+        self.border = border
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self.workers = workers
         
         # This is how many iterations of the two steps need to be made
-        self.iters = int(math.log(self.size - 1, 2))
+        if square:
+            self.iters = int(math.log(width - 1, 2))
+        else:
+            self.iters = max(len(get_axis_plan(width)), len(get_axis_plan(height))) - 1
+        self.dtype = dtype
         
-        # This is where the output map will be saved
-        self.output = np.zeros((self.size, self.size))
+        if not lazy:
+            self.generate()
+    
+    def build(self):
+        '''
+        Creates the map from scratch
+        @return: Returns the map
+        '''
+        # This is where the output map will be saved, the workers of the block engine share an in memory map
+        self._location = None
+        if self.engine == 'block' and self.workers > 1 and self.square and self.store is None:
+            self.output, self._location = shared_map((self.height, self.width), self.dtype)
+        else:
+            self.output = allocate_map((self.height, self.width), self.dtype, self.store)
         
         # Start the process of creating the final map
         self.init_corners()
         
         # Generate the map
         self.generate_map()
+        return self.output
     
     def init_corners(self):
         '''
         Initializes the values of the corners to a random value in the given range
+        When there is a fixed border it is copied in instead and the corners come from it
         '''
-        self.output[0, 0] = random.uniform(self.min_val, self.max_val) # North West Corner
-        self.output[0, self.size-1] = random.uniform(self.min_val, self.max_val) # North East Corner
-        self.output[self.size-1, 0] = random.uniform(self.min_val, self.max_val) # South East Corner
-        self.output[self.size-1,self.size-1] = random.uniform(self.min_val, self.max_val) # South West Corner
-        print("Corners of the Diamond Square Map have been initialized")
+        if self.border is not None:
+            top, bottom, left, right = self.border
+            self.output[0, :] = top
+            self.output[-1, :] = bottom
+            self.output[:, 0] = left
+            self.output[:, -1] = right
+            return
+        if self.engine == 'block':
+            self.output[::self.size-1, ::self.size-1] = corner_grid(self.block_seed, self.size, self.min_val, self.max_val)
+            return
+        nw, ne, se, sw = self.rng.uniform(self.min_val, self.max_val, size=4)
+        self.output[0, 0] = nw # North West Corner
+        self.output[0, -1] = ne # North East Corner
+        self.output[-1, 0] = se # South East Corner
+        self.output[-1, -1] = sw # South West Corner
     
     def generate_map(self):
         '''
-        Generates the Diamond Square Map and saves it to self.output
+        Generates the Diamond Square Map with the selected engine and saves it to self.output
+        '''
+        if not self.square:
+            self.generate_map_general()
+        elif self.engine == 'numpy':
+            self.generate_map_numpy()
+        elif self.engine == 'block' and self.workers > 1:
+            generate_parallel(self.output, self.size, self.block_seed, self.max_val, self.workers, self.border, self.observer,
+                              self._location)
+        elif self.engine == 'block':
+            coarse = np.array(self.output[::self.size-1, ::self.size-1])
+            for level, grid, origin in refine_levels(coarse, 0, self.iters, self.size, self.block_seed, self.max_val,
+                                                     border=self.border, out=self.output, observer=self.observer):
+                pass
+            if isinstance(self.output, np.memmap):
+                self.output.flush()
+        else:
+            self.generate_map_loop()
+    
+    def generate_map_loop(self):
+        '''
+        Generates the Diamond Square Map one point at a time and saves it to self.output
         '''
         # Loop through completing however many iterations need to be made.
         # The number of sub divisions at each iteration gets multiplied by 4 at each step
         for i in range(1, self.iters + 2):
-            # Calculate the distance between the center and the influences
-            d = int(self.size // math.pow(2, i))
+            # The cached plan has the distance between the center and the influences and all of the locations
+            plan = get_level_plan(self.size, i)
+            d = plan.d
             # This means that it is finished
             if d == 0:
                 break
-            print("Starting Iteration: ", i, "/", (self.iters + 1))
-            print("\t Point Distance: ", d)
             depth_modifier = 1 / (2*i) + .5
             
-            # Calculate where all of the midpoints are for the diamond step
-            midpoints = self.find_midpoint_locs(d)
-                  
             # For every midpoint perform the diamond step
-            for mpt in midpoints:
+            for mpt in plan.midpoint_locs():
 #                 print("Performing diamond step for point: ", mpt)
                 self.diamond_step(mpt[1], mpt[0], d, depth_modifier)
 #                 display_image("Debug", self.output)
             
-            # Calculate where all of the points for the square step are
-            sq_points = self.find_square_step_locs(midpoints, d)
-            
-            # For every point in sq_points calculate their values using the square step
-            for spt in sq_points:
+            # For every point of the square step calculate their values
+            for spt in plan.square_step_locs():
 #                 print("Performing square step for point: ", spt)
                 self.square_step(spt[1], spt[0], d, depth_modifier)
 #                 display_image("Debug", self.output)
             
+            self.observer.progress("diamond_square", i, self.iters)
+            self.observer.preview("diamond_square", self.output)
+    
+    def generate_map_numpy(self):
+        '''
+        Generates the Diamond Square Map one whole level at a time and saves it to self.output
+        Every midpoint of a level only depends on the level before it, so each step is done as
+        operations on strided slices of the output. The slices are worked on in bands of rows from
+        top to bottom, which keeps the temporaries small and reads memory mapped maps in order.
+        The random values are drawn in row order so the map doesn't depend on the band size
+        '''
+        out = self.output
+        for i in range(1, self.iters + 2):
+            plan = get_level_plan(self.size, i)
+            d = plan.d
+            if d == 0:
+                break
+            depth_modifier = 1 / (2*i) + .5
+            mag = self.max_val * depth_modifier
+            n = plan.n
+            
+            # mid are the rows/cols of the midpoints, edge of the corners, low/high the corners before/after each midpoint
+            mid, edge, low, high = plan.mid_slice, plan.edge_slice, plan.low_slice, plan.high_slice
+            centers = out[mid, mid]
+            
+            # Diamond step, every center is the mean of the four corners of its cell
+            for r0, r1 in iter_bands(n, n):
+                rows = slice(r0, r1)
+                total = out[low, low][rows] + out[low, high][rows]
+                total += out[high, low][rows]
+                total += out[high, high][rows]
+                total /= 4
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                centers[rows] = total
+            
+            # Square step for the points on the corner rows, left/right are corners and up/down are centers
+            # The first and last rows are on the border of the map and only have 3 influences
+            tb = out[edge, mid]
+            for r0, r1 in iter_bands(n + 1, n):
+                rows = slice(r0, r1)
+                total = out[edge, low][rows] + out[edge, high][rows]
+                above = max(r0, 1)
+                total[above - r0:] += centers[above - 1:r1 - 1]
+                below = min(r1, n)
+                total[:below - r0] += centers[r0:below]
+                count = np.full((r1 - r0, 1), 4.0)
+                if r0 == 0:
+                    count[0] = 3
+                if r1 == n + 1:
+                    count[-1] = 3
+                total /= count
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                self.write_square_rows(tb, total, r0, r1, n + 1)
+            
+            # Square step for the points on the center rows, up/down are corners and left/right are centers
+            lr = out[mid, edge]
+            for r0, r1 in iter_bands(n, n + 1):
+                rows = slice(r0, r1)
+                total = out[low, edge][rows] + out[high, edge][rows]
+                total[:, 1:] += centers[rows]
+                total[:, :-1] += centers[rows]
+                total[:, 1:-1] /= 4
+                total[:, 0] /= 3
+                total[:, -1] /= 3
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                if self.border is None:
+                    lr[rows] = total
+                else:
+                    lr[rows, 1:-1] = total[:, 1:-1]
+            
+            self.observer.progress("diamond_square", i, self.iters)
+            self.observer.preview("diamond_square", out)
+        
+        if isinstance(out, np.memmap):
+            out.flush()
+    
+    def generate_map_general(self):
+        '''
+        Generates a map of any width and height one level at a time and saves it to self.output
+        Each axis is split on its own (see get_axis_plan), a level puts a point in the middle of every gap that is longer
+        than one. The diamond step fills the cells that are split both ways from their four corners, the square step
+        the points between two corners from them and the centers next to them. An axis that is already done only has
+        the square step along the other axis left, that is midpoint displacement along a line.
+        Like the numpy engine the steps are done in bands of rows with the random values drawn in row order
+        '''
+        out = self.output
+        rows_plan = get_axis_plan(self.height)
+        cols_plan = get_axis_plan(self.width)
+        for i in range(1, self.iters + 1):
+            rows = rows_plan[min(i, len(rows_plan)) - 1]
+            cols = cols_plan[min(i, len(cols_plan)) - 1]
+            mag = self.max_val * (1 / (2*i) + .5)
             
+            # Diamond step, every center is the mean of the four corners of its cell
+            for r0, r1 in iter_bands(len(rows.mids), len(cols.mids)):
+                low, high = rows.low[r0:r1], rows.high[r0:r1]
+                total = out[np.ix_(low, cols.low)] + out[np.ix_(low, cols.high)]
+                total += out[np.ix_(high, cols.low)]
+                total += out[np.ix_(high, cols.high)]
+                total /= 4
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                out[np.ix_(rows.mids[r0:r1], cols.mids)] = total
+            
+            # Square step for the points on the corner rows, left/right are corners and up/down are centers
+            # when the gap above/below the row was split
+            for r0, r1 in iter_bands(len(rows.points), len(cols.mids)):
+                points = rows.points[r0:r1]
+                total = out[np.ix_(points, cols.low)] + out[np.ix_(points, cols.high)]
+                count = np.full((r1 - r0, 1), 2.0)
+                for side in (rows.before[r0:r1], rows.after[r0:r1]):
+                    split = side >= 0
+                    total[split] += out[np.ix_(rows.mids[side[split]], cols.mids)]
+                    count[split] += 1
+                total /= count
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                out[np.ix_(points, cols.mids)] = total
+            
+            # Square step for the points on the center rows, up/down are corners and left/right are centers
+            count = 2.0 + (cols.before >= 0) + (cols.after >= 0)
+            left, right = cols.before >= 0, cols.after >= 0
+            for r0, r1 in iter_bands(len(rows.mids), len(cols.points)):
+                mids = rows.mids[r0:r1]
+                total = out[np.ix_(rows.low[r0:r1], cols.points)] + out[np.ix_(rows.high[r0:r1], cols.points)]
+                total[:, left] += out[np.ix_(mids, cols.mids[cols.before[left]])]
+                total[:, right] += out[np.ix_(mids, cols.mids[cols.after[right]])]
+                total /= count
+                total += self.rng.uniform(-mag, mag, size=total.shape)
+                out[np.ix_(mids, cols.points)] = total
+            
+            # The square step wrote over the border, it's put back before the next level reads it
+            if self.border is not None:
+                self.init_corners()
+            
+            self.observer.progress("diamond_square", i, self.iters)
+            self.observer.preview("diamond_square", out)
+        
+        if isinstance(out, np.memmap):
+            out.flush()
+    
+    def check_block_engine(self):
+        '''
+        Makes sure the map uses the block engine, the other engines draw their random values in order
+        so a level or a part of the map can't be made without making everything before it
+        '''
+        if self.engine != 'block':
+            raise Exception("Engine Error: Levels and parts of a map need the 'block' engine")
+    
+    def iter_levels(self, coarse=None, coarse_level=0, stop_level=None, rect=None):
+        '''
+        Generates the map a level at a time without touching self.output, every level is yielded as soon as it's done.
+        Level i of the map is every (size - 1) / 2^i th point of the finished map, so each one is a preview of it
+        @param coarse: A level of the map to start from instead of the corners, like one yielded earlier and saved
+        @param coarse_level: The level of coarse
+        @param stop_level: The level to stop at, the full resolution level self.iters by default
+        @param rect: The (top, left, bottom, right) of the area to refine in pixels of the full map, bottom and right
+                     aren't included, only the points it depends on are generated. None for the whole map
+        @return: Returns an iterator of (level, window, origin) starting with coarse_level, the window holds the level's points in the area
+                 (plus a margin before the last level) and origin is the (row, column) of its first point in the level
+        '''
+        self.check_block_engine()
+        stop_level = self.iters if stop_level is None else stop_level
+        if coarse is None:
+            coarse = corner_grid(self.block_seed, self.size, self.min_val, self.max_val, self.border).astype(self.dtype)
+            coarse_level = 0
+        if coarse.shape != ((1 << coarse_level) + 1,) * 2:
+            raise Exception("Level Error: Level " + str(coarse_level) + " of the map has to be " + str((1 << coarse_level) + 1) + " points square")
+        if not 0 <= coarse_level <= stop_level <= self.iters:
+            raise Exception("Level Error: The levels must be between 0 and " + str(self.iters) + " with the coarse one first")
+        for result in refine_levels(coarse, coarse_level, stop_level, self.size, self.block_seed, self.max_val,
+                                    rect, self.border, observer=self.observer):
+            yield result
+    
+    def coarse_map(self, level):
+        '''
+        Generates only the first levels of the map, quick to show as a preview and to refine from later
+        @param level: The level to stop at
+        @return: Returns the (2^level + 1) square map, the same as every (size - 1) / 2^level th point of the full map
+        '''
+        for _, grid, _ in self.iter_levels(stop_level=level):
+            pass
+        return grid
+    
+    def refine(self, coarse, coarse_level, rect=None, stop_level=None, out=None):
+        '''
+        Refines a coarse level of the map, or a part of it, to a finer level.
+        The values are the same as in the full map so refined parts line up with each other
+        @param coarse: The (2^coarse_level + 1) square level of the map, like one from coarse_map
+        @param coarse_level: The level of coarse
+        @param rect: The (top, left, bottom, right) of the area in pixels of the full map, bottom and right aren't included.
+                     None for the whole map
+        @param stop_level: The level to refine to, the full resolution level self.iters by default
+        @param out: An optional array to write the result into
+        @return: Returns the points of stop_level inside of rect, at full resolution that's the pixels of rect
+        '''
+        for _, grid, _ in self.iter_levels(coarse, coarse_level, stop_level, rect):
+            pass
+        if out is not None:
+            out[...] = grid
+            return out
+        return grid
+    
+    def write_square_rows(self, points, total, r0, r1, rows):
+        '''
+        Writes a band of square step values, skipping the border rows when the border is fixed
+        @param points: The view of the square step points
+        @param total: The values for rows r0 to r1
+        @param r0: The first row of the band
+        @param r1: The row after the last row of the band
+        @param rows: How many rows points has
+        '''
+        if self.border is None:
+            points[r0:r1] = total
+            return
+        start = 1 if r0 == 0 else 0
+        stop = (r1 - r0) - 1 if r1 == rows else (r1 - r0)
+        points[r0 + start:r0 + stop] = total[start:stop]
+    
     def find_midpoint_locs(self, d):
         '''
         Calculates the locations of the midpoints used in the diamond step
         @param d: The distance in the horizontal/vertical between points
         @return: Returns a list of the midpoints
         '''
-        midpoints = []
-        rc = (self.size // (d*2))
-        m_ct = int(math.pow(rc, 2))
-        
-        # For every row find all of the midpoints in that row
-        start_point = [d, d] # The first point to find all of the others based off of
-        midpoints.append(start_point)
-        done = False
-        
-        # Iterate through the rest of the points
-        for riter in range(0, rc):
-            for citer in range(0, rc):
-                # Skip the first point
-                if riter == 0 and citer == 0:
-                    continue
-                point_row = d + (2*riter*d)
-                point_col = d + (2*citer*d)
-                point = [point_row, point_col]
-                midpoints.append(point)
-            
-                
-        print()    
-        return midpoints
+        plan = get_level_plan(self.size, level_for_distance(self.size, d))
+        return [list(mpt) for mpt in plan.midpoint_locs()]
        
     def find_square_step_locs(self, midpoints, d):
         '''
         Finds the locations of the points to calculate during the square step
-        @param midpoints: The midpoints used in the diamond step
+        @param midpoints: The midpoints used in the diamond step, the locations come from the same plan
         @param d: The distance in the horizontal/vertical between points
         @return: Returns the locations for the square step
         '''
-        locs = []
-        for mpt in midpoints:
-            # Try to add a point to the left of the midpoint
-            try:
-                u_coord = mpt[1] - d
-                loc = [mpt[0], u_coord]
-                if loc not in locs:
-                    locs.append(loc)
-            except:
-                print("Left edge out of the array skipping it")
-            
-            # Try to add a point to the right of the midpoint
-            try:
-                u_coord = mpt[1] + d
-                loc = [mpt[0], u_coord]
-                if loc not in locs:
-                    locs.append(loc)
-            except:
-                print("Right edge out of the array skipping it")
-                
-            # Try to add a point to the top of the midpoint
-            try:
-                v_coord = mpt[0] + d
-                loc = [v_coord, mpt[1]]
-                if loc not in locs:
-                    locs.append(loc)
-            except:
-                print("Top edge out of the array skipping it")
-                
-            # Try to add a point to the bottom of the midpoint
-            try:
-                v_coord = mpt[0] - d
-                loc = [v_coord, mpt[1]]
-                if loc not in locs:
-                    locs.append(loc)
-            except:
-                print("Bottom edge out of the array skipping it")
-        
-        return locs   
+        plan = get_level_plan(self.size, level_for_distance(self.size, d))
+        return [list(spt) for spt in plan.square_step_locs()]
                 
     def diamond_step(self, u_cent, v_cent, d, depth_modifier):
         '''
@@ -191,7 +440,7 @@ class DiamondSquareGenerator():
         
         # Calculate the value for the midpoint and set it in the output
         mag = (self.max_val * depth_modifier)
-        value = (mean(influence)) + (random.uniform(-mag, mag))  # * self.roughness)) / 2
+        value = (mean(influence)) + (self.draws.uniform(-mag, mag))  # * self.roughness)) / 2
         self.output[v_cent, u_cent] = value
         
     def square_step(self, u_cent, v_cent, d, depth_modifier):
@@ -205,6 +454,11 @@ class DiamondSquareGenerator():
         u_cent = int(u_cent)
         v_cent = int(v_cent)
         d = int(d)
+        
+        # A fixed border is never overwritten
+        if self.border is not None and (u_cent in (0, self.size - 1) or v_cent in (0, self.size - 1)):
+            return
+        
         # Try to add all of the edges of the square step to the influence list
         influence = []
         
@@ -225,18 +479,20 @@ class DiamondSquareGenerator():
             influence.append(self.output[v_cent-d, u_cent])
         
         mag = self.max_val * depth_modifier
-        value = (mean(influence))+ (random.uniform(-mag, mag)) # * self.roughness)) / 2
+        value = (mean(influence))+ (self.draws.uniform(-mag, mag)) # * self.roughness)) / 2
         self.output[v_cent, u_cent] = value
         
         
 if __name__ == '__main__':
     seed = random.random()
-    dsg = DiamondSquareGenerator(seed, 127, 0, 255, .4)
+    dsg = DiamondSquareGenerator(seed, 129, 0, 255, .4)
     arr = dsg.output.astype(np.uint8)
     display_image("test", arr)
     import os
+    from export import export_png
     save_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "images", str(calendar.timegm(time.gmtime()))) + ".png"
-    cv2.imwrite(save_path ,arr)
+    # Saved as a 16 bit PNG so none of the precision is lost
+    export_png(dsg.output, save_path, 0, 255)
         
         
         
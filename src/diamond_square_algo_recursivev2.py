@@ -1,26 +1,43 @@
 from __future__ import print_function
 
 import numpy as np
-import random as random
 import math
 import cv2
 from sklearn.preprocessing import normalize
 from general_functions import *
+import diamond_square_plan
+from diamond_square_plan import get_level_plan, iter_bands, is_square_size
+from progress import NULL_OBSERVER
     
-class DiamondSquareMap():
+class DiamondSquareMap(BaseGenerator):
     
-    def __init__(self, size, range_min, range_max):
+    def __init__(self, size, range_min, range_max, seed=None, engine='recursive', dtype=np.float64, store=None, observer=None, cache=None):
         '''
         Constructor for the DiamondSquareMap generator
         @param size: The square size of the map to generate
         @param range_min: Used in the magnitude computation
         @param range_max: Used in the magnitude computation
+        @param seed: The seed for the random values, every map has its own random number generator
+        @param engine: 'recursive' to split the map into quadrants, 'iterative' to do each level of every quadrant at once in place
+        @param dtype: The dtype of the map, np.float32 halves the memory
+        @param store: Where to keep the map, None for memory, a file path to memory map or an existing array to fill
+        @param observer: A ProgressObserver that gets told about the progress, nothing is reported by default
+        @param cache: An OutputCache to take the map from when it was generated before, None to always generate
         '''
+        if engine not in ('recursive', 'iterative'):
+            raise Exception("The engine needs to be either 'recursive' or 'iterative'")
+        BaseGenerator.__init__(self, seed, {'size': size, 'range_min': range_min, 'range_max': range_max,
+                                            'engine': engine, 'dtype': np.dtype(dtype).str}, cache, store)
+        self._engine = engine
+        self._rng = make_rng(seed)
+        self._draws = RandomBlock(self._rng)
         self._size = size
         self._range_max = range_max
         self._range_min = range_min
         self._range_dif = self._range_max - self._range_min
-        self._output = None
+        self._dtype = dtype
+        self._store = store
+        self._observer = observer if observer is not None else NULL_OBSERVER
         
     def generate_map(self):
         '''
@@ -28,27 +45,41 @@ class DiamondSquareMap():
         Saves the final map in self._output
         '''
         # Make sure the size value is of the correct format
-        if (self._size - 1) % 2 != 0:
+        if not is_square_size(self._size):
             raise Exception("The square size of the ds map needs to be of form 2^n + 1")
         
         # Fill the output array with zeros for starters
-        self._output = np.zeros((self._size, self._size))
+        self._output = allocate_map((self._size, self._size), self._dtype, self._store)
         
         # Use range_dif as magnitude, this will be normalized later so it doesn't really matter
         self.generate_corners(self._range_dif)
         
-        # Make the call to the recursive function calculate_map
-        self._output = self.calculate_map(self._output, self._range_dif)
+        if self._engine == 'iterative':
+            self.calculate_map_iterative(self._range_dif)
+        else:
+            # Make the call to the recursive function calculate_map
+            self._output = self.calculate_map(self._output, self._range_dif)
+            self._observer.progress("diamond_square_map", 1, 1)
+            self._observer.preview("diamond_square_map", self._output)
+        
+        if isinstance(self._output, np.memmap):
+            self._output.flush()
+    
+    def build(self):
+        '''
+        Generates the map for generate() and the lazy output
+        @return: Returns the map
+        '''
+        self.generate_map()
+        return self._output
         
     def generate_corners(self, magnitude):
         '''
         Fills the corners of the output map with random values for use in the height map generation
         @param magnitude: The maximum magnitude of the random values
         '''
-        self._output[0][0] = random.uniform(-magnitude, magnitude)
-        self._output[0][self._size - 1] = random.uniform(-magnitude, magnitude)
-        self._output[self._size - 1][0] = random.uniform(-magnitude, magnitude)
-        self._output[self._size - 1][self._size - 1] = random.uniform(-magnitude, magnitude)
+        corners = self._rng.uniform(-magnitude, magnitude, size=4)
+        self._output[0][0], self._output[0][self._size - 1], self._output[self._size - 1][0], self._output[self._size - 1][self._size - 1] = corners
         
     def calculate_map(self, ds_map, magnitude):
         '''
@@ -92,6 +123,109 @@ class DiamondSquareMap():
              
             return ds_map
         
+    def calculate_map_iterative(self, magnitude):
+        '''
+        Calculates the values for self._output one level at a time, in place.
+        Every quadrant of a level is handled in the same batch with the same magnitude schedule as calculate_map,
+        and the edges shared by two quadrants are blended the same way the square step blends them.
+        The quadrants are worked on in bands of rows from top to bottom so the random values only need a band
+        sized buffer and memory mapped maps are read in order
+        @param magnitude: The magnitude of the random value for the full map
+        '''
+        out = self._output
+        
+        # One scratch buffer for the random values of a band, plus one row carried over to the next band
+        n_max = (self._size - 1) // 2
+        noise_buf = np.empty(min(4 * n_max * n_max, max(diamond_square_plan.BAND_ELEMENTS, 4 * n_max)), dtype=out.dtype)
+        carry_buf = np.empty(n_max, dtype=out.dtype)
+        
+        levels = int(math.log(self._size - 1, 2))
+        level = 1
+        plan = get_level_plan(self._size, level)
+        while plan.d > 0:
+            n = plan.n
+            mid, edge, low, high = plan.mid_slice, plan.edge_slice, plan.low_slice, plan.high_slice
+            
+            # The last level of the recursion uses the magnitude as it is for both steps
+            if plan.d == 1:
+                diamond_mag = square_mag = magnitude
+            else:
+                diamond_mag = magnitude * 1.5
+                square_mag = magnitude * .1
+            
+            # Diamond step, the midpoint of every quadrant is the mean of its corners
+            centers = out[mid, mid]
+            for r0, r1 in iter_bands(n, n):
+                rows = slice(r0, r1)
+                band = centers[rows]
+                np.add(out[low, low][rows], out[low, high][rows], out=band)
+                band += out[high, low][rows]
+                band += out[high, high][rows]
+                band /= 4
+                band += self.fill_noise(noise_buf[:(r1 - r0) * n].reshape(r1 - r0, n), diamond_mag)
+            
+            # Square step, each quadrant uses its two corners on an edge and its midpoint for the edge's midpoint
+            # Edges inside the map get a value from both quadrants next to them which are blended
+            # Every quadrant draws four random values, for its top, bottom, left and right edges
+            tb = out[edge, mid]
+            lr = out[mid, edge]
+            carry = carry_buf[:n]
+            for r0, r1 in iter_bands(n, 4 * n):
+                rows = slice(r0, r1)
+                noise = self.fill_noise(noise_buf[:(r1 - r0) * 4 * n].reshape(r1 - r0, 4, n), square_mag)
+                
+                # Edge row j is the top of quadrant row j and the bottom of quadrant row j - 1
+                # The first row of the map only has quadrants below it
+                inner = 1 if r0 == 0 else 0
+                band = tb[rows]
+                np.add(out[edge, low][rows], out[edge, high][rows], out=band)
+                band[inner:] *= 2
+                band += centers[rows]
+                band[inner:] += centers[r0 + inner - 1:r1 - 1]
+                band /= 3
+                band += noise[:, 0]
+                band[1:] += noise[:-1, 1]
+                if r0 > 0:
+                    band[0] += carry
+                band[inner:] *= .475
+                carry[...] = noise[-1, 1]
+                
+                # The left/right edges of these quadrant rows
+                band = lr[rows]
+                np.add(out[low, edge][rows], out[high, edge][rows], out=band)
+                band[:, 1:-1] *= 2
+                band[:, 1:] += centers[rows]
+                band[:, :-1] += centers[rows]
+                band /= 3
+                band[:, :-1] += noise[:, 2]
+                band[:, 1:] += noise[:, 3]
+                band[:, 1:-1] *= .475
+            
+            # The last row of the map only has quadrants above it
+            band = tb[n]
+            np.add(out[edge, low][n], out[edge, high][n], out=band)
+            band += centers[n - 1]
+            band /= 3
+            band += carry
+            
+            self._observer.progress("diamond_square_map", level, levels)
+            self._observer.preview("diamond_square_map", out)
+            magnitude *= .5
+            level += 1
+            plan = get_level_plan(self._size, level)
+    
+    def fill_noise(self, noise, magnitude):
+        '''
+        Fills the given buffer with new random values in the range of the magnitude
+        @param noise: The buffer to fill
+        @param magnitude: The max magnitude of the random values
+        @return: Returns the filled buffer
+        '''
+        self._rng.random(out=noise, dtype=noise.dtype)
+        noise *= 2 * magnitude
+        noise -= magnitude
+        return noise
+        
     def diamond_step(self, ds_map, magnitude):
         '''
         Performs the diamond step on the given ds_map
@@ -106,7 +240,7 @@ class DiamondSquareMap():
         corner_vals.append(ds_map[size - 1][0])
         corner_vals.append(ds_map[size - 1][size - 1])
         
-        mid_point = mean(corner_vals) + (random.uniform(-magnitude, magnitude))
+        mid_point = mean(corner_vals) + (self._draws.uniform(-magnitude, magnitude))
         mid_coord = (size // 2)
         ds_map[mid_coord][mid_coord] = mid_point
         
@@ -134,10 +268,10 @@ class DiamondSquareMap():
         # The coordinates to calculate at
         coords = [(mid_coord, 0), (0, mid_coord), (size - 1, mid_coord), (mid_coord, size - 1)]
         new_vals = [
-            (nw + mid + sw) / 3 + (random.uniform(-magnitude, magnitude)),
-            (nw + mid + ne) / 3 + (random.uniform(-magnitude, magnitude)),
-            (sw + mid + se) / 3 + (random.uniform(-magnitude, magnitude)),
-            (se + mid + ne) / 3 + (random.uniform(-magnitude, magnitude))]
+            (nw + mid + sw) / 3 + (self._draws.uniform(-magnitude, magnitude)),
+            (nw + mid + ne) / 3 + (self._draws.uniform(-magnitude, magnitude)),
+            (sw + mid + se) / 3 + (self._draws.uniform(-magnitude, magnitude)),
+            (se + mid + ne) / 3 + (self._draws.uniform(-magnitude, magnitude))]
         
         for c, val in enumerate(new_vals):
             if val < 0:
@@ -153,20 +287,10 @@ class DiamondSquareMap():
         
         return ds_map
     
-    def get_output(self):
-        '''
-        Gets the unnormalized output array
-        @return: Unnormalized output array
-        '''
-        if type(self._output) is None:
-            self.generate_map()
-        return self._output
-
 if __name__ == '__main__':
     sq_size = 513
     max_height = 255
     map_controller = DiamondSquareMap(sq_size, 0, max_height)
-    map_controller.generate_map()
     map = map_controller.get_output()
     map = map.astype(np.uint8)
     display_image("Unnormalized", map)
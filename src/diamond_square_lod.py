@@ -0,0 +1,262 @@
+from general_functions import *
+from progress import NULL_OBSERVER
+import numpy as np
+
+# The random values of every step of a level come in square blocks of this many points, each block has its own
+# random number generator keyed by the seed, the level, the step and where the block is. Any part of a level can
+# then be generated on its own and get the same values it would get in the full map
+BLOCK_POINTS = 128
+
+# The steps of a level, used in the keys of the blocks
+DIAMOND_STEP = 0
+ROW_STEP = 1
+COLUMN_STEP = 2
+
+def block_noise(seed, level, step, r0, r1, c0, c1):
+    '''
+    Gets the random values in [0, 1) for a rectangle of the points of one step of a level
+    @param seed: The int seed of the map
+    @param level: The level the points are on
+    @param step: DIAMOND_STEP, ROW_STEP or COLUMN_STEP
+    @param r0: The first row of points
+    @param r1: The row after the last one
+    @param c0: The first column of points
+    @param c1: The column after the last one
+    @return: Returns a (r1 - r0, c1 - c0) float64 array
+    '''
+    out = np.empty((r1 - r0, c1 - c0))
+    b = BLOCK_POINTS
+    for br in range(r0 // b, (r1 - 1) // b + 1):
+        for bc in range(c0 // b, (c1 - 1) // b + 1):
+            rng = np.random.default_rng(np.random.SeedSequence([seed, level, step, br, bc]))
+            rs, re = max(r0, br * b), min(r1, (br + 1) * b)
+            # The block is drawn row by row so only the rows down to the last one needed are drawn
+            block = rng.random((re - br * b, b))
+            cs, ce = max(c0, bc * b), min(c1, (bc + 1) * b)
+            out[rs - r0:re - r0, cs - c0:ce - c0] = block[rs - br * b:re - br * b, cs - bc * b:ce - bc * b]
+    return out
+
+def level_noise(seed, level, step, r0, r1, c0, c1):
+    '''
+    Gets the random values of block_noise for one map or for a batch of maps
+    @param seed: The int seed of the map, or a list of them for a batch of maps
+    @return: Returns a (r1 - r0, c1 - c0) array, or a (seeds, r1 - r0, c1 - c0) one for a batch
+    '''
+    if isinstance(seed, (list, tuple)):
+        return np.stack([block_noise(one, level, step, r0, r1, c0, c1) for one in seed])
+    return block_noise(seed, level, step, r0, r1, c0, c1)
+
+def iter_block_bands(start, stop):
+    '''
+    Splits the rows start to stop into bands that line up with the noise blocks
+    @return: Returns an iterator of (first row, row after the last) pairs
+    '''
+    while start < stop:
+        end = min(stop, (start // BLOCK_POINTS + 1) * BLOCK_POINTS)
+        yield start, end
+        start = end
+
+def corner_grid(seed, size, min_val, max_val, border=None):
+    '''
+    Gets the four corners of a map, the map at level 0
+    @param seed: The int seed of the map
+    @param size: The size of the map
+    @param min_val: The minimum value of the corners
+    @param max_val: The maximum value of the corners
+    @param border: Optional (top, bottom, left, right) fixed border of the map to take the corners from
+    @return: Returns a 2x2 float64 array
+    '''
+    grid = min_val + (max_val - min_val) * block_noise(seed, 0, DIAMOND_STEP, 0, 2, 0, 2)
+    if border is not None:
+        apply_border(grid, (0, 0), 0, size, border)
+    return grid
+
+def apply_border(grid, origin, level, size, border):
+    '''
+    Overwrites the points of a level's window that are on the fixed border of the map
+    The sides are written in the same order as DiamondSquareGenerator.init_corners so the corners match
+    @param grid: The window of the level, or a (..., h, w) batch of windows
+    @param origin: The (row, column) of the window's first point in the level's points
+    @param level: The level of the window
+    @param size: The size of the full map
+    @param border: The (top, bottom, left, right) of the map
+    '''
+    d = (size - 1) >> level
+    last = 1 << level
+    h, w = grid.shape[-2:]
+    r0, c0 = origin
+    top, bottom, left, right = [np.asarray(side) for side in border]
+    cols = slice(c0 * d, (c0 + w - 1) * d + 1, d)
+    rows = slice(r0 * d, (r0 + h - 1) * d + 1, d)
+    if r0 == 0:
+        grid[..., 0, :] = top[cols]
+    if r0 + h - 1 == last:
+        grid[..., -1, :] = bottom[cols]
+    if c0 == 0:
+        grid[..., :, 0] = left[rows]
+    if c0 + w - 1 == last:
+        grid[..., :, -1] = right[rows]
+
+def refine_level(grid, origin, level, size, seed, max_val, border=None, out=None):
+    '''
+    Does one level of Diamond Square on a window of the level before it
+    Points next to the sides of the window that aren't the sides of the map are missing some of their
+    influences, they are still filled in but are wrong and have to be cropped off.
+    A batch of maps is done at once when grid has a leading axis and seed is a list with a seed for every map
+    @param grid: The window of the level before, (h, w) or (seeds, h, w)
+    @param origin: The (row, column) of the window's first point in the points of the level before
+    @param level: The level to do
+    @param size: The size of the full map
+    @param seed: The int seed of the map, or a list of them for a batch
+    @param max_val: The maximum value of the map, it sets the magnitude of the random values
+    @param border: Optional (top, bottom, left, right) fixed border of the map
+    @param out: An optional (2h - 1, 2w - 1) array to write the new window into
+    @return: Returns the new window, its origin is twice the old one
+    '''
+    h, w = grid.shape[-2:]
+    new = out if out is not None else np.empty(grid.shape[:-2] + (2 * h - 1, 2 * w - 1), dtype=grid.dtype)
+    new[..., ::2, ::2] = grid
+    diamond_rows(grid, new, origin, level, seed, max_val, 0, h - 1)
+    square_rows(grid, new, origin, level, seed, max_val, 0, h)
+    if border is not None:
+        apply_border(new, (2 * origin[0], 2 * origin[1]), level, size, border)
+    return new
+
+def diamond_rows(grid, new, origin, level, seed, max_val, r0, r1):
+    '''
+    Does the diamond step of a level for the cells between rows r0 and r1 of grid, every center is the mean
+    of the four corners of its cell
+    @param grid: The window of the level before, or a (seeds, h, w) batch of them
+    @param new: The window of the level, its even rows and columns are grid
+    @param origin: The (row, column) of grid's first point in the points of the level before
+    @param level: The level to do
+    @param seed: The int seed of the map, or a list of them for a batch
+    @param max_val: The maximum value of the map
+    @param r0: The first row of cells
+    @param r1: The row after the last one
+    '''
+    r_lo, c_lo = origin
+    w = grid.shape[-1]
+    mag = max_val * (1 / (2 * level) + .5)
+    centers = new[..., 1::2, 1::2]
+    for g0, g1 in iter_block_bands(r_lo + r0, r_lo + r1):
+        l0, l1 = g0 - r_lo, g1 - r_lo
+        total = grid[..., l0:l1, :-1] + grid[..., l0:l1, 1:]
+        total += grid[..., l0 + 1:l1 + 1, :-1]
+        total += grid[..., l0 + 1:l1 + 1, 1:]
+        total /= 4
+        total += (2 * level_noise(seed, level, DIAMOND_STEP, g0, g1, c_lo, c_lo + w - 1) - 1) * mag
+        centers[..., l0:l1, :] = total
+
+def square_rows(grid, new, origin, level, seed, max_val, r0, r1):
+    '''
+    Does the square step of a level for rows r0 to r1 of grid and the center rows below them,
+    the diamond step has to be done for the rows around them first
+    @param grid: The window of the level before, or a (seeds, h, w) batch of them
+    @param new: The window of the level, its even rows and columns are grid and its odd ones the centers
+    @param origin: The (row, column) of grid's first point in the points of the level before
+    @param level: The level to do
+    @param seed: The int seed of the map, or a list of them for a batch
+    @param max_val: The maximum value of the map
+    @param r0: The first row
+    @param r1: The row after the last one
+    '''
+    h, w = grid.shape[-2:]
+    r_lo, c_lo = origin
+    last = 1 << (level - 1)
+    mag = max_val * (1 / (2 * level) + .5)
+    centers = new[..., 1::2, 1::2]
+
+    # The points on the corner rows, left/right are corners and up/down are centers
+    # The first and last rows of the map only have 3 influences
+    for g0, g1 in iter_block_bands(r_lo + r0, r_lo + r1):
+        l0, l1 = g0 - r_lo, g1 - r_lo
+        total = grid[..., l0:l1, :-1] + grid[..., l0:l1, 1:]
+        above = max(l0, 1)
+        total[..., above - l0:, :] += centers[..., above - 1:l1 - 1, :]
+        below = min(l1, h - 1)
+        total[..., :below - l0, :] += centers[..., l0:below, :]
+        count = np.full((l1 - l0, 1), 4.0)
+        count[(np.arange(g0, g1) == 0) | (np.arange(g0, g1) == last)] = 3
+        total /= count
+        total += (2 * level_noise(seed, level, ROW_STEP, g0, g1, c_lo, c_lo + w - 1) - 1) * mag
+        new[..., 2 * l0:2 * l1:2, 1::2] = total
+
+    # The points on the center rows, up/down are corners and left/right are centers
+    count = np.full(w, 4.0)
+    count[(np.arange(c_lo, c_lo + w) == 0) | (np.arange(c_lo, c_lo + w) == last)] = 3
+    for g0, g1 in iter_block_bands(r_lo + r0, r_lo + min(r1, h - 1)):
+        l0, l1 = g0 - r_lo, g1 - r_lo
+        total = grid[..., l0:l1, :] + grid[..., l0 + 1:l1 + 1, :]
+        total[..., 1:] += centers[..., l0:l1, :]
+        total[..., :-1] += centers[..., l0:l1, :]
+        total /= count
+        total += (2 * level_noise(seed, level, COLUMN_STEP, g0, g1, c_lo, c_lo + w) - 1) * mag
+        new[..., 2 * l0 + 1:2 * l1 + 1:2, ::2] = total
+
+def window_ranges(rect, coarse_level, stop_level, size):
+    '''
+    Works out which points every level needs so the points in rect are right at the last level
+    Going up a level, the points within one point of the window are needed and then the corners around those
+    @param rect: The (top, left, bottom, right) of the area in pixels of the full map, bottom and right aren't included
+    @param coarse_level: The level to start from
+    @param stop_level: The level to stop at
+    @param size: The size of the full map
+    @return: Returns a dict from every level to the ((first row, last row), (first column, last column)) of its points
+    '''
+    top, left, bottom, right = rect
+    d = (size - 1) >> stop_level
+    last = 1 << stop_level
+    # The points of the last level that are inside of the rect
+    rows = (max(0, -(-top // d)), min(last, -(-bottom // d) - 1))
+    cols = (max(0, -(-left // d)), min(last, -(-right // d) - 1))
+    if rows[0] > rows[1] or cols[0] > cols[1]:
+        raise Exception("Rect Error: The rect doesn't have any points of the level in it")
+    ranges = {stop_level: (rows, cols)}
+    for level in range(stop_level, coarse_level, -1):
+        last = 1 << (level - 1)
+        rows = (max(0, (rows[0] - 1) // 2), min(last, (rows[1] + 2) // 2))
+        cols = (max(0, (cols[0] - 1) // 2), min(last, (cols[1] + 2) // 2))
+        ranges[level - 1] = (rows, cols)
+    return ranges
+
+def refine_levels(coarse, coarse_level, stop_level, size, seed, max_val, rect=None, border=None, out=None, observer=NULL_OBSERVER):
+    '''
+    Refines a coarse level of a map level by level, only doing the points that the area in rect depends on
+    @param coarse: The full map at coarse_level, a (2^coarse_level + 1) square array
+    @param coarse_level: The level of coarse
+    @param stop_level: The level to stop at
+    @param size: The size of the full map
+    @param seed: The int seed of the map
+    @param max_val: The maximum value of the map
+    @param rect: The (top, left, bottom, right) of the area in pixels of the full map, None for the whole map
+    @param border: Optional (top, bottom, left, right) fixed border of the map
+    @param out: An optional array to write the last level's window into
+    @param observer: A ProgressObserver that gets told about every finished level
+    @return: Returns an iterator of (level, window, origin) for coarse_level and after every level, the window is the
+             points of the level inside of the area (more of them until the last level) and origin is the (row, column)
+             of its first point
+    '''
+    if rect is None:
+        rect = (0, 0, size, size)
+    ranges = window_ranges(rect, coarse_level, stop_level, size)
+    (r0, r1), (c0, c1) = ranges[coarse_level]
+    grid = coarse[r0:r1 + 1, c0:c1 + 1]
+    origin = (r0, c0)
+    yield coarse_level, grid, origin
+    for level in range(coarse_level + 1, stop_level + 1):
+        (r0, r1), (c0, c1) = ranges[level]
+        rows = slice(r0 - 2 * origin[0], r1 - 2 * origin[0] + 1)
+        cols = slice(c0 - 2 * origin[1], c1 - 2 * origin[1] + 1)
+        full = (rows.start == 0 and cols.start == 0 and rows.stop == 2 * grid.shape[0] - 1 and cols.stop == 2 * grid.shape[1] - 1)
+        if level == stop_level and out is not None and full:
+            grid = refine_level(grid, origin, level, size, seed, max_val, border, out)
+        else:
+            grid = refine_level(grid, origin, level, size, seed, max_val, border)[rows, cols]
+            if level == stop_level and out is not None:
+                out[...] = grid
+                grid = out
+        origin = (r0, c0)
+        observer.progress("diamond_square", level, stop_level)
+        observer.preview("diamond_square", grid)
+        yield level, grid, origin
@@ -0,0 +1,145 @@
+from general_functions import *
+from diamond_square_lod import BLOCK_POINTS, diamond_rows, square_rows, apply_border
+from progress import NULL_OBSERVER
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import weakref
+
+def split_rows(rows, parts):
+    '''
+    Splits rows into about parts ranges that start on the edges of the noise blocks so no block is made twice
+    @param rows: How many rows there are
+    @param parts: How many ranges to make at most
+    @return: Returns a list of (first row, row after the last) pairs
+    '''
+    bands = -(-rows // BLOCK_POINTS)
+    per_part = -(-bands // parts)
+    return [(start * BLOCK_POINTS, min(rows, (start + per_part) * BLOCK_POINTS)) for start in range(0, bands, per_part)]
+
+def open_map(location, shape, dtype):
+    '''
+    Opens the map a worker writes into
+    @param location: ('shm', name) for a shared memory block or ('file', path, offset) for a memory mapped file
+    @param shape: The shape of the map
+    @param dtype: The dtype of the map
+    @return: Returns the SharedMemory (None for a file) and the array
+    '''
+    if location[0] == 'shm':
+        shm = shared_memory.SharedMemory(name=location[1])
+        return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return None, np.memmap(location[1], dtype=dtype, mode='r+', shape=shape, offset=location[2])
+
+def shared_map(shape, dtype):
+    '''
+    Allocates a zero filled map in a new shared memory block, generate_parallel's workers write straight into it so
+    the map is never copied. The block is freed once the map and every view of it are gone
+    @param shape: The shape of the map
+    @param dtype: The dtype of the map
+    @return: Returns the map and its location for generate_parallel, see open_map
+    '''
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    weakref.finalize(out, free_shared, shm)
+    return out, ('shm', shm.name)
+
+def free_shared(shm):
+    '''
+    Closes and unlinks the shared memory block of a map from shared_map
+    '''
+    shm.close()
+    shm.unlink()
+
+def refine_rows(location, shape, dtype, step, level, size, seed, max_val, r0, r1):
+    '''
+    Does one step of a level for some rows of the map inside of a worker process
+    The level before is every 2d th point of the map and the level every d th one so both are views of the map
+    @param location: Where the map is, see open_map
+    @param shape: The shape of the map
+    @param dtype: The dtype of the map
+    @param step: 'diamond' or 'square'
+    @param level: The level to do
+    @param size: The size of the map
+    @param seed: The int seed of the map
+    @param max_val: The maximum value of the map
+    @param r0: The first row of the level before to do
+    @param r1: The row after the last one
+    '''
+    shm, out = open_map(location, shape, dtype)
+    d = (size - 1) >> level
+    grid = out[::2 * d, ::2 * d]
+    new = out[::d, ::d]
+    if step == 'diamond':
+        diamond_rows(grid, new, (0, 0), level, seed, max_val, r0, r1)
+    else:
+        square_rows(grid, new, (0, 0), level, seed, max_val, r0, r1)
+    if isinstance(out, np.memmap):
+        out.flush()
+    del grid, new, out
+    if shm is not None:
+        shm.close()
+
+def generate_parallel(out, size, seed, max_val, workers, border=None, observer=NULL_OBSERVER, location=None):
+    '''
+    Generates a block engine map with every level split across worker processes that all write into one map.
+    The random values come from blocks keyed by where they are, so the map is the same bit for bit for any number of workers
+    and the same as the one the block engine makes in one process.
+    The diamond step of a level has to finish before its square step starts, so there are two rounds of work per level.
+    Levels with only one band of rows are done here since sending them out would cost more than doing them
+    @param out: The (size, size) map with its corners set, a map from shared_map or an np.memmap of a file is written
+                in place, any other array is copied into shared memory and back
+    @param size: The size of the map
+    @param seed: The int seed of the map
+    @param max_val: The maximum value of the map
+    @param workers: How many processes to use
+    @param border: Optional (top, bottom, left, right) fixed border of the map
+    @param observer: A ProgressObserver that gets told about every finished level
+    @param location: The location shared_map gave for out, None when out isn't from shared_map
+    @return: Returns out
+    '''
+    iters = int(math.log(size - 1, 2))
+    shm = None
+    grid = new = None
+    if location is not None:
+        work = out
+    elif isinstance(out, np.memmap) and out.filename is not None and out.flags.c_contiguous:
+        out.flush()
+        work = out
+        location = ('file', out.filename, out.offset)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=out.nbytes)
+        work = np.ndarray(out.shape, dtype=out.dtype, buffer=shm.buf)
+        work[...] = out
+        location = ('shm', shm.name)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for level in range(1, iters + 1):
+                d = (size - 1) >> level
+                grid = work[::2 * d, ::2 * d]
+                new = work[::d, ::d]
+                h = grid.shape[0]
+                if h - 1 <= BLOCK_POINTS:
+                    diamond_rows(grid, new, (0, 0), level, seed, max_val, 0, h - 1)
+                    square_rows(grid, new, (0, 0), level, seed, max_val, 0, h)
+                else:
+                    for step, rows in (('diamond', h - 1), ('square', h)):
+                        futures = [pool.submit(refine_rows, location, work.shape, work.dtype, step, level, size, seed, max_val, r0, r1)
+                                   for r0, r1 in split_rows(rows, workers)]
+                        for future in futures:
+                            future.result()
+                if border is not None:
+                    apply_border(new, (0, 0), level, size, border)
+                observer.progress("diamond_square", level, iters)
+                observer.preview("diamond_square", new)
+        if shm is not None:
+            out[...] = work
+        elif isinstance(out, np.memmap):
+            out.flush()
+    finally:
+        if shm is not None:
+            # The views have to be gone before the block can be closed
+            grid = new = work = None
+            shm.close()
+            shm.unlink()
+    return out
@@ -0,0 +1,154 @@
+import itertools
+import math
+import numpy as np
+
+# Plans are cached per (size, level) so the planning cost is only paid once per map size
+_plan_cache = {}
+
+class LevelPlan():
+    '''
+    The locations touched by one level of the diamond square algorithm on a square map.
+    Only the row/column coordinates are stored, every location is a pair of them
+    '''
+
+    def __init__(self, size, level):
+        '''
+        Constructor for the LevelPlan class
+        @param size: The square size of the map
+        @param level: The iteration of the algorithm, starting at 1
+        '''
+        self.size = size
+        self.level = level
+
+        # d is the distance from a midpoint to its influences, s is the distance between corners
+        self.d = int(size // math.pow(2, level))
+        self.s = 2 * self.d
+
+        # n is how many cells there are along each side, e is the coordinate of the last corner
+        self.n = (size - 1) // self.s if self.d > 0 else 0
+        self.e = self.n * self.s
+
+        # The coordinates of the midpoints and of the corners along one axis
+        self.mids = np.arange(self.d, self.e, self.s, dtype=np.intp) if self.n else np.zeros(0, np.intp)
+        self.edges = np.arange(0, self.e + 1, self.s, dtype=np.intp) if self.n else np.zeros(0, np.intp)
+
+        # The same coordinates as slices for working on whole levels at once
+        # low/high are the corners before/after every midpoint, inner are the corners not on the border
+        self.mid_slice = slice(self.d, self.e, self.s)
+        self.edge_slice = slice(0, self.e + 1, self.s)
+        self.inner_slice = slice(self.s, self.e, self.s)
+        self.low_slice = slice(0, self.e, self.s)
+        self.high_slice = slice(self.s, self.e + 1, self.s)
+
+    def midpoint_locs(self):
+        '''
+        @return: Returns an iterator over the (row, col) locations of the diamond step
+        '''
+        mids = self.mids.tolist()
+        return itertools.product(mids, mids)
+
+    def square_step_locs(self):
+        '''
+        Every location is only generated once and all of them are inside the map
+        @return: Returns an iterator over the (row, col) locations of the square step
+        '''
+        mids = self.mids.tolist()
+        edges = self.edges.tolist()
+        return itertools.chain(itertools.product(edges, mids), itertools.product(mids, edges))
+
+def get_level_plan(size, level):
+    '''
+    Gets the cached plan for the given size and level, building it the first time
+    @param size: The square size of the map
+    @param level: The iteration of the algorithm, starting at 1
+    @return: Returns the LevelPlan
+    '''
+    key = (size, level)
+    plan = _plan_cache.get(key)
+    if plan is None:
+        plan = LevelPlan(size, level)
+        _plan_cache[key] = plan
+    return plan
+
+def level_for_distance(size, d):
+    '''
+    Finds the level that has the given point distance
+    @param size: The square size of the map
+    @param d: The distance in the horizontal/vertical between points
+    @return: Returns the level
+    '''
+    return int(math.log(size // d, 2))
+
+def is_square_size(size):
+    '''
+    @return: Returns whether size is 2^n + 1, the only sizes the square plans work for
+    '''
+    return size >= 2 and ((size - 1) & (size - 2)) == 0
+
+# Axis plans are cached per length like the level plans
+_axis_cache = {}
+
+class AxisLevel():
+    '''
+    One level of midpoint splitting along one axis of any length, used for maps that aren't 2^n + 1 square.
+    Every gap between two points that are next to each other gets a point in its middle, so the gaps don't
+    have to be the same size and the levels go on until every gap is one long
+    '''
+
+    def __init__(self, points):
+        '''
+        Constructor for the AxisLevel class
+        @param points: The sorted coordinates that are done before the level
+        '''
+        self.points = points
+        split = np.diff(points) > 1
+
+        # low/high are the points before/after every midpoint
+        self.low = points[:-1][split]
+        self.high = points[1:][split]
+        self.mids = (self.low + self.high) // 2
+
+        # For every point, the index in mids of the midpoint of the gap before/after it, -1 if that gap isn't split
+        mid_index = np.cumsum(split) - 1
+        self.before = np.full(len(points), -1, dtype=np.intp)
+        self.after = np.full(len(points), -1, dtype=np.intp)
+        self.before[1:] = np.where(split, mid_index, -1)
+        self.after[:-1] = np.where(split, mid_index, -1)
+
+        self.next_points = np.union1d(points, self.mids)
+
+def get_axis_plan(length):
+    '''
+    Gets the cached levels for an axis, building them the first time
+    @param length: How many points the axis has, at least 2
+    @return: Returns a list of AxisLevel, one for every level until every point is done
+    '''
+    plan = _axis_cache.get(length)
+    if plan is None:
+        plan = []
+        points = np.array([0, length - 1], dtype=np.intp)
+        while len(points) < length:
+            plan.append(AxisLevel(points))
+            points = plan[-1].next_points
+        # One more level with nothing to split for when the other axis has more levels
+        plan.append(AxisLevel(points))
+        _axis_cache[length] = plan
+    return plan
+
+# How many values a band of rows should hold, this bounds the temporaries of the level passes
+BAND_ELEMENTS = 1 << 20
+
+def iter_bands(rows, row_len, band_elements=None):
+    '''
+    Splits the rows of a level into bands that are worked on one after another from top to bottom
+    so only one band of temporaries is alive at once and memory mapped maps are read in order
+    @param rows: How many rows there are
+    @param row_len: How many values are in each row
+    @param band_elements: Roughly how many values should be in a band, defaults to BAND_ELEMENTS
+    @return: Returns an iterator over (start, stop) row ranges
+    '''
+    if band_elements is None:
+        band_elements = BAND_ELEMENTS
+    band_rows = max(1, band_elements // max(1, row_len))
+    for start in range(0, rows, band_rows):
+        yield start, min(rows, start + band_rows)
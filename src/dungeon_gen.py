@@ -1,25 +1,206 @@
+from __future__ import print_function
 
-        
-        
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+from general_functions import *
+from progress import NULL_OBSERVER
+from random_lines import directed_walk
+import numpy as np
+import time
+
+# The values of the tiles in the output
+WALL = 0
+ROOM = 1
+CORRIDOR = 2
+
+class SpatialHash():
+
+    def __init__(self, cell_size):
+        '''
+        Constructor for the SpatialHash class, a grid of buckets that remembers which rooms touch which bucket.
+        Queries only look at the buckets around a rectangle so their cost doesn't grow with the number of rooms
+        @param cell_size: The width/height of a bucket, it should be about the size of the biggest room
+        '''
+        self.cell_size = cell_size
+        self.buckets = {}
+
+    def cells(self, x, y, w, h):
+        '''
+        @return: Returns every bucket key the rectangle touches
+        '''
+        cs = self.cell_size
+        for bx in range(x // cs, (x + w - 1) // cs + 1):
+            for by in range(y // cs, (y + h - 1) // cs + 1):
+                yield bx, by
+
+    def insert(self, index, rect):
+        '''
+        Adds a rectangle to every bucket it touches
+        @param index: The id of the rectangle
+        @param rect: The (x, y, w, h) of the rectangle
+        '''
+        for key in self.cells(*rect):
+            self.buckets.setdefault(key, []).append(index)
+
+    def query(self, rect):
+        '''
+        @param rect: The (x, y, w, h) of the area to look in
+        @return: Returns the ids of the rectangles in the buckets the area touches
+        '''
+        found = set()
+        for key in self.cells(*rect):
+            found.update(self.buckets.get(key, ()))
+        return found
+
+    def ring_cells(self, bx, by, ring):
+        '''
+        @return: Returns the bucket keys that are exactly ring buckets away from (bx, by)
+        '''
+        if ring == 0:
+            yield bx, by
+            return
+        for kx in range(bx - ring, bx + ring + 1):
+            yield kx, by - ring
+            yield kx, by + ring
+        for ky in range(by - ring + 1, by + ring):
+            yield bx - ring, ky
+            yield bx + ring, ky
+
+    def nearest(self, x, y, rects, max_rings):
+        '''
+        Finds the rectangle closest to a point by looking at rings of buckets further and further out
+        @param x: The x coordinate of the point
+        @param y: The y coordinate of the point
+        @param rects: The list of every rectangle, indexed by id
+        @param max_rings: How many rings out to look before giving up
+        @return: Returns the id of the closest rectangle, None if there isn't one in range
+        '''
+        cs = self.cell_size
+        bx, by = x // cs, y // cs
+        best = None
+        best_dist = None
+        for ring in range(max_rings + 1):
+            for key in self.ring_cells(bx, by, ring):
+                for index in self.buckets.get(key, ()):
+                    rx, ry, rw, rh = rects[index]
+                    dist = abs(rx + rw // 2 - x) + abs(ry + rh // 2 - y)
+                    if best is None or dist < best_dist:
+                        best, best_dist = index, dist
+            # Anything in a ring further out than this one is at least ring buckets away
+            if best is not None and best_dist <= ring * cs:
+                break
+        return best
+
+class DungeonGenerator(BaseGenerator):
+
+    def __init__(self, width, height, seed=None, max_rooms=1000, min_room=4, max_room=16, margin=1, attempts=10, observer=None):
+        '''
+        Constructor for the DungeonGenerator class, places random rooms and joins each one to its closest neighbour
+        @param width: The width of the dungeon in tiles
+        @param height: The height of the dungeon in tiles
+        @param seed: The seed for the random generation
+        @param max_rooms: The most rooms to place
+        @param min_room: The smallest width/height of a room
+        @param max_room: The biggest width/height of a room
+        @param margin: How many wall tiles have to be between two rooms
+        @param attempts: How many tries each room gets before the placement gives up on it
+        @param observer: A ProgressObserver that gets told about every placed room, nothing is reported by default
+        '''
+        if min(width, height) - 2 * margin < min_room:
+            raise Exception("Size Error: The dungeon must fit a room of 'min_room' tiles inside of the margin")
+        BaseGenerator.__init__(self, seed, {'width': width, 'height': height, 'max_rooms': max_rooms, 'min_room': min_room,
+                                            'max_room': max_room, 'margin': margin, 'attempts': attempts})
+        self.width = width
+        self.height = height
+        self.max_rooms = max_rooms
+        self.min_room = min_room
+        self.max_room = max_room
+        self.margin = margin
+        self.attempts = attempts
+        self.rng = make_rng(seed)
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self.rooms = []
+        self.index = SpatialHash(max_room + 2 * margin)
+        self.tiles = None
+
+    def build(self):
+        '''
+        Places the rooms, carves them out and connects them with corridors
+        @return: Returns the uint8 tile array
+        '''
+        self.rooms = []
+        self.index = SpatialHash(self.max_room + 2 * self.margin)
+        self.tiles = np.full((self.height, self.width), WALL, dtype=np.uint8)
+        self.place_rooms()
+        for x, y, w, h in self.rooms:
+            self.tiles[y:y + h, x:x + w] = ROOM
+        self.connect_rooms()
+        return self.tiles
+
+    def place_rooms(self):
+        '''
+        Tries random rectangles and keeps every one that doesn't come within the margin of a room that's already placed
+        '''
+        m = self.margin
+        tries = self.max_rooms * self.attempts
+        # Draw every candidate at once, only the overlap test is done one at a time
+        # Rooms are never bigger than the inside of the margin so small dungeons don't get rooms off the map
+        biggest = np.minimum(self.max_room, [self.width - 2 * m, self.height - 2 * m])
+        sizes = self.rng.integers(self.min_room, biggest + 1, size=(tries, 2))
+        corners = self.rng.random((tries, 2))
+        xs = (corners[:, 0] * (self.width - sizes[:, 0] - 2 * m + 1)).astype(np.intp) + m
+        ys = (corners[:, 1] * (self.height - sizes[:, 1] - 2 * m + 1)).astype(np.intp) + m
+        for x, y, w, h in zip(xs.tolist(), ys.tolist(), sizes[:, 0].tolist(), sizes[:, 1].tolist()):
+            if len(self.rooms) == self.max_rooms:
+                break
+            if self.overlaps(x, y, w, h):
+                continue
+            self.index.insert(len(self.rooms), (x, y, w, h))
+            self.rooms.append((x, y, w, h))
+            self.observer.progress("dungeon_rooms", len(self.rooms), self.max_rooms)
+
+    def overlaps(self, x, y, w, h):
+        '''
+        Checks a rectangle against only the rooms in the buckets around it
+        @return: Returns whether the rectangle comes within the margin of a room
+        '''
+        m = self.margin
+        grown = (x - m, y - m, w + 2 * m, h + 2 * m)
+        for index in self.index.query(grown):
+            rx, ry, rw, rh = self.rooms[index]
+            if rx < x + w + m and x - m < rx + rw and ry < y + h + m and y - m < ry + rh:
+                return True
+        return False
+
+    def connect_rooms(self):
+        '''
+        Joins every room to the closest room that is already joined with a corridor, so every room can be reached
+        The rooms are joined in a snake order over the buckets so the closest joined room is almost always a bucket or two away
+        The corridors are random walks from one room's center to the other's
+        '''
+        joined = SpatialHash(self.index.cell_size)
+        cs = joined.cell_size
+        max_rings = max(self.width, self.height) // cs + 1
+        def snake_key(index):
+            x, y, w, h = self.rooms[index]
+            row = (y + h // 2) // cs
+            col = (x + w // 2) // cs
+            return row, col if row % 2 == 0 else -col
+        for count, index in enumerate(sorted(range(len(self.rooms)), key=snake_key)):
+            x, y, w, h = self.rooms[index]
+            center = (x + w // 2, y + h // 2)
+            if count > 0:
+                other = joined.nearest(center[0], center[1], self.rooms, max_rings)
+                ox, oy, ow, oh = self.rooms[other]
+                path = directed_walk(center, (ox + ow // 2, oy + oh // 2), self.rng)
+                # Only carve through walls so the rooms keep their tiles
+                corridor = self.tiles[path[:, 1], path[:, 0]]
+                self.tiles[path[:, 1], path[:, 0]] = np.where(corridor == WALL, CORRIDOR, corridor)
+            joined.insert(index, (x, y, w, h))
+            self.observer.progress("dungeon_corridors", count + 1, len(self.rooms))
+
+if __name__ == '__main__':
+    size = 4096
+    start = time.time()
+    dungeon = DungeonGenerator(size, size, seed=1, max_rooms=5000)
+    tiles = dungeon.generate()
+    print("Placed", len(dungeon.rooms), "rooms on a", size, "x", size, "map in", time.time() - start, "seconds")
+    display_image("Dungeon", tiles * 127)
@@ -0,0 +1,195 @@
+from __future__ import print_function
+
+from general_functions import *
+from progress import NULL_OBSERVER
+import numpy as np
+import time
+
+def erosion_output(heights, out):
+    '''
+    Gets the float array an erosion step works on
+    @param heights: The heightmap
+    @param out: None to work on a float copy of heights, or the array to work on, which can be heights itself
+    @return: Returns the array
+    '''
+    if out is None:
+        dtype = heights.dtype if heights.dtype.kind == 'f' else np.float64
+        return np.array(heights, dtype=dtype)
+    if out is not heights:
+        out[...] = heights
+    return out
+
+def thermal_erosion(heights, iterations=50, talus=None, rate=0.5, out=None, observer=NULL_OBSERVER):
+    '''
+    Crumbles every slope that is steeper than the talus angle, the material slides down to the lower neighbour.
+    Every iteration is done as whole array operations on the differences between each pair of neighbours, first the
+    pairs above each other and then the pairs beside each other. Part of the difference over the talus moves from
+    the higher cell to the lower one, a cell can lose to all four neighbours at once so only a quarter of rate moves per pair
+    @param heights: The 2D heightmap
+    @param iterations: How many times to let the slopes crumble
+    @param talus: The biggest height difference between two neighbours that stays put, defaults to 4 / size of the
+                  height range of the map
+    @param rate: How much of the excess moves each iteration, from 0 to 1
+    @param out: None to erode a copy of heights, or the array to write into, heights itself to erode in place
+    @param observer: A ProgressObserver that gets told about every finished iteration
+    @return: Returns the eroded heightmap
+    '''
+    out = erosion_output(heights, out)
+    rows, cols = out.shape
+    if talus is None:
+        low, high = find_min_max(out)
+        talus = 4.0 * (high - low) / max(rows, cols)
+    share = rate / 4
+
+    # The buffers are reused by every iteration, for the pairs above each other and then the pairs beside each other
+    buffers = np.empty(2 * rows * cols, dtype=out.dtype)
+    pairs = [(out[:-1], out[1:]), (out[:, :-1], out[:, 1:])]
+    for iteration in range(iterations):
+        for first, second in pairs:
+            flow = buffers[:first.size].reshape(first.shape)
+            within = buffers[first.size:2 * first.size].reshape(first.shape)
+            # flow is how much moves from the first cell of each pair to the second, negative to move the other way.
+            # Taking the difference clipped to the talus away from the difference leaves the part past the talus
+            np.subtract(first, second, out=flow)
+            np.clip(flow, -talus, talus, out=within)
+            flow -= within
+            flow *= share
+            first -= flow
+            second += flow
+        observer.progress("thermal_erosion", iteration + 1, iterations)
+        observer.preview("thermal_erosion", out)
+    return out
+
+def bilinear(flat, width, x, y):
+    '''
+    Gets the height and gradient of the map at many points at once
+    @param flat: The map as a flat array
+    @param width: The width of the map
+    @param x: The x coordinates of the points, they have to be inside of the map
+    @param y: The y coordinates of the points
+    @return: Returns the index of the top left corner of every point's cell, the offsets into the cell, the heights and the gradients
+    '''
+    ix = x.astype(np.intp)
+    iy = y.astype(np.intp)
+    u = x - ix
+    v = y - iy
+    corner = iy * width + ix
+    h00 = flat[corner]
+    h10 = flat[corner + 1]
+    h01 = flat[corner + width]
+    h11 = flat[corner + width + 1]
+    grad_x = (h10 - h00) * (1 - v) + (h11 - h01) * v
+    grad_y = (h01 - h00) * (1 - u) + (h11 - h10) * u
+    height = (h00 * (1 - u) + h10 * u) * (1 - v) + (h01 * (1 - u) + h11 * u) * v
+    return corner, u, v, height, grad_x, grad_y
+
+def hydraulic_erosion(heights, droplets=100000, seed=None, out=None, batch=1 << 16, max_steps=64, inertia=.05,
+                      capacity=4.0, min_slope=.01, erode_rate=.3, deposit_rate=.3, evaporation=.02, gravity=4.0,
+                      observer=NULL_OBSERVER):
+    '''
+    Rains droplets on the map that run downhill, picking up sediment where they speed up and dropping it where
+    they slow down or fill up. A whole batch of droplets is moved one step at a time as arrays of positions,
+    directions, speeds, water and sediment, and their changes to the map are added up with np.add.at.
+    Droplets that run off the map or stop moving are dropped from the batch along with their sediment
+    @param heights: The 2D heightmap
+    @param droplets: How many droplets to rain in total, the budget of the erosion
+    @param seed: The seed for where the droplets land
+    @param out: None to erode a copy of heights, or the array to write into, heights itself to erode in place
+    @param batch: How many droplets are moved together
+    @param max_steps: The most steps a droplet takes
+    @param inertia: How much of its direction a droplet keeps instead of following the slope, from 0 to 1
+    @param capacity: How much sediment a droplet can carry for its speed, water and slope
+    @param min_slope: The smallest slope used for the capacity so droplets on flat ground still carry some
+    @param erode_rate: How much of the free capacity is picked up each step
+    @param deposit_rate: How much of the sediment over the capacity is dropped each step
+    @param evaporation: How much of its water a droplet loses each step
+    @param gravity: How much going downhill speeds a droplet up
+    @param observer: A ProgressObserver that gets told about every finished batch
+    @return: Returns the eroded heightmap
+    '''
+    out = erosion_output(heights, out)
+    rows, cols = out.shape
+    flat = out.reshape(-1)
+    if not np.shares_memory(flat, out):
+        raise Exception("Erosion Error: The output has to be contiguous")
+    rng = make_rng(seed)
+
+    done = 0
+    while done < droplets:
+        count = min(batch, droplets - done)
+        x = rng.random(count) * (cols - 1)
+        y = rng.random(count) * (rows - 1)
+        dir_x = np.zeros(count)
+        dir_y = np.zeros(count)
+        speed = np.ones(count)
+        water = np.ones(count)
+        sediment = np.zeros(count)
+
+        for step in range(max_steps):
+            corner, u, v, height, grad_x, grad_y = bilinear(flat, cols, x, y)
+
+            # The new direction is a mix of the old one and downhill
+            dir_x *= inertia
+            dir_x -= grad_x * (1 - inertia)
+            dir_y *= inertia
+            dir_y -= grad_y * (1 - inertia)
+            length = np.hypot(dir_x, dir_y)
+            np.divide(dir_x, length, out=dir_x, where=length > 0)
+            np.divide(dir_y, length, out=dir_y, where=length > 0)
+            x += dir_x
+            y += dir_y
+
+            alive = (length > 0) & (x >= 0) & (x < cols - 1) & (y >= 0) & (y < rows - 1)
+            if not alive.all():
+                x, y, dir_x, dir_y = x[alive], y[alive], dir_x[alive], dir_y[alive]
+                speed, water, sediment = speed[alive], water[alive], sediment[alive]
+                corner, u, v, height = corner[alive], u[alive], v[alive], height[alive]
+            if len(x) == 0:
+                break
+
+            new_height = bilinear(flat, cols, x, y)[3]
+            drop = new_height - height
+
+            # Going uphill or carrying too much drops sediment, otherwise the droplet picks some up
+            carry = np.maximum(-drop, min_slope) * speed * water * capacity
+            deposit = np.where(drop > 0, np.minimum(drop, sediment), (sediment - carry) * deposit_rate)
+            erode = np.minimum((carry - sediment) * erode_rate, -drop)
+            change = np.where((sediment > carry) | (drop > 0), deposit, -erode)
+            sediment -= change
+
+            # The change is spread over the four corners of the cell the droplet left
+            np.add.at(flat, corner, change * (1 - u) * (1 - v))
+            np.add.at(flat, corner + 1, change * u * (1 - v))
+            np.add.at(flat, corner + cols, change * (1 - u) * v)
+            np.add.at(flat, corner + cols + 1, change * u * v)
+
+            speed = np.sqrt(np.maximum(speed * speed - drop * gravity, 0))
+            water *= 1 - evaporation
+
+        done += count
+        observer.progress("hydraulic_erosion", done, droplets)
+        observer.preview("hydraulic_erosion", out)
+    return out
+
+def erode(heights, thermal_iterations=50, droplets=100000, seed=None, out=None, observer=NULL_OBSERVER, **kwargs):
+    '''
+    Runs hydraulic erosion and then thermal erosion to smooth out the steep spots it leaves
+    @param heights: The 2D heightmap
+    @param thermal_iterations: The iteration budget of the thermal erosion
+    @param droplets: The droplet budget of the hydraulic erosion
+    @param seed: The seed for the hydraulic erosion
+    @param out: None to erode a copy of heights, or the array to write into, heights itself to erode in place
+    @param observer: A ProgressObserver that gets told about the progress of both stages
+    @param kwargs: Passed on to hydraulic_erosion
+    @return: Returns the eroded heightmap
+    '''
+    out = hydraulic_erosion(heights, droplets, seed, out, observer=observer, **kwargs)
+    return thermal_erosion(out, thermal_iterations, out=out, observer=observer)
+
+if __name__ == '__main__':
+    from diamond_square_algo_alt import DiamondSquareGenerator
+    heights = DiamondSquareGenerator(1, 2049, 0, 255, .4, engine='numpy').output
+    start = time.time()
+    eroded = erode(heights, seed=1)
+    print("Eroded a 2049 x 2049 map in", time.time() - start, "seconds")
+    display_image("Eroded", quantize(eroded))
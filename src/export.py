@@ -0,0 +1,223 @@
+from general_functions import *
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import zipfile
+import struct
+import json
+import zlib
+import os
+
+# How many rows of the map are read, converted and compressed at a time
+EXPORT_CHUNK_ROWS = 256
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def iter_row_blocks(arr, chunk_rows=EXPORT_CHUNK_ROWS):
+    '''
+    Reads a map a block of rows at a time, for a memmapped map only that block is paged in
+    @return: Returns an iterator of (first row, block) pairs
+    '''
+    for start in range(0, arr.shape[0], chunk_rows):
+        yield start, np.asarray(arr[start:start + chunk_rows])
+
+def png_chunk(kind, data):
+    '''
+    @return: Returns the bytes of a PNG chunk with its length and CRC
+    '''
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def filter_rows(block, bits):
+    '''
+    Turns a block of integer rows into PNG scanlines with the Sub filter, every byte is stored as the difference to
+    the same byte of the pixel before it which makes smooth maps compress much better
+    @param block: The (rows, width) block of uint8 or uint16 values
+    @param bits: 8 or 16
+    @return: Returns the filtered scanlines as bytes
+    '''
+    bpp = bits // 8
+    raw = np.ascontiguousarray(block.astype('>u2' if bits == 16 else np.uint8)).view(np.uint8).reshape(block.shape[0], -1)
+    lines = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+    lines[:, 0] = 1
+    lines[:, 1:bpp + 1] = raw[:, :bpp]
+    np.subtract(raw[:, bpp:], raw[:, :-bpp], out=lines[:, bpp + 1:])
+    return lines.tobytes()
+
+def deflate_block(data, last, level, strategy):
+    '''
+    Compresses one part of a zlib stream on its own, the parts are ended on a byte boundary so they can be joined
+    @param data: The bytes to compress
+    @param last: Whether this is the last part of the stream
+    @param level: The zlib compression level
+    @param strategy: The zlib strategy
+    @return: Returns the raw deflate bytes
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, strategy)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+def export_png(arr, path, min_limit=None, max_limit=None, bits=16, level=6, strategy=zlib.Z_RLE, threads=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    '''
+    Saves a map as a grayscale PNG, 16 bits by default so the precision isn't thrown away
+    The map is read a block of rows at a time and each block is compressed by a thread of its own, zlib lets go of the
+    GIL while it works. Only a few blocks are in flight at once so a memmapped map is never copied in full
+    @param arr: The 2D map, like a generator's output or an np.memmap
+    @param path: Where to save the PNG
+    @param min_limit: The value that becomes black, the minimum of arr if None
+    @param max_limit: The value that becomes white, the maximum of arr if None
+    @param bits: 16 or 8 bits per pixel
+    @param level: The zlib compression level from 0 to 9
+    @param strategy: The zlib strategy, run length encoding is much faster than the default on filtered heightmaps
+                     and compresses them about as well
+    @param threads: How many threads compress blocks, defaults to the number of cores
+    @param chunk_rows: How many rows go in a block
+    @return: Returns path
+    '''
+    if bits not in (8, 16):
+        raise Exception("Export Error: The bits per pixel must be 8 or 16")
+    if min_limit is None or max_limit is None:
+        low, high = find_min_max(arr)
+        min_limit = low if min_limit is None else min_limit
+        max_limit = high if max_limit is None else max_limit
+    height, width = arr.shape
+    dtype = np.uint16 if bits == 16 else np.uint8
+    threads = threads if threads is not None else (os.cpu_count() or 1)
+
+    with open(path, 'wb') as f, ThreadPoolExecutor(max_workers=threads) as pool:
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bits, 0, 0, 0, 0)))
+        # The zlib header, the blocks are raw deflate and the checksum comes at the end
+        f.write(png_chunk(b'IDAT', b'\x78\x9c'))
+        adler = 1
+        pending = collections.deque()
+        for start, block in iter_row_blocks(arr, chunk_rows):
+            data = filter_rows(quantize(block, min_limit, max_limit, dtype), bits)
+            adler = zlib.adler32(data, adler)
+            pending.append(pool.submit(deflate_block, data, start + chunk_rows >= height, level, strategy))
+            while len(pending) > 2 * threads:
+                f.write(png_chunk(b'IDAT', pending.popleft().result()))
+        while pending:
+            f.write(png_chunk(b'IDAT', pending.popleft().result()))
+        f.write(png_chunk(b'IDAT', struct.pack('>I', adler & 0xffffffff)))
+        f.write(png_chunk(b'IEND', b''))
+    return path
+
+def write_npy(f, arr, dtype, chunk_rows):
+    '''
+    Writes a map to an open file in the .npy format a block of rows at a time
+    '''
+    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                             'fortran_order': False, 'shape': tuple(arr.shape)})
+    for _, block in iter_row_blocks(arr, chunk_rows):
+        f.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+
+def export_npy(arr, path, dtype=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    '''
+    Saves a map as a raw .npy file that np.load can read or memory map, a block of rows at a time
+    @param arr: The map
+    @param path: Where to save it
+    @param dtype: The dtype to save it as, the map's dtype by default
+    @param chunk_rows: How many rows to convert and write at once
+    @return: Returns path
+    '''
+    with open(path, 'wb') as f:
+        write_npy(f, arr, dtype if dtype is not None else arr.dtype, chunk_rows)
+    return path
+
+def export_npz(arr, path, name='heightmap', dtype=None, compressed=True, chunk_rows=EXPORT_CHUNK_ROWS):
+    '''
+    Saves a map into a .npz file that np.load can read, streamed in blocks of rows instead of copied first
+    @param arr: The map
+    @param path: Where to save it
+    @param name: The name of the map inside of the file
+    @param dtype: The dtype to save it as, the map's dtype by default
+    @param compressed: Whether to deflate the file
+    @param chunk_rows: How many rows to convert and write at once
+    @return: Returns path
+    '''
+    compression = zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, 'w', compression=compression, allowZip64=True) as zf:
+        with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+            write_npy(f, arr, dtype if dtype is not None else arr.dtype, chunk_rows)
+    return path
+
+def export_tiles(arr, directory, tile_size=512, fmt='png', min_limit=None, max_limit=None, bits=16, threads=None):
+    '''
+    Saves a map as a grid of tiles plus a manifest.json that says how to put them back together
+    One row of tiles is read from the map at a time and its tiles are encoded by a pool of threads
+    @param arr: The map
+    @param directory: The directory to save the tiles in
+    @param tile_size: The width/height of a tile, the last row and column of tiles can be smaller
+    @param fmt: 'png' for grayscale PNG tiles or 'npy' for raw tiles that keep the values as they are
+    @param min_limit: The value that becomes black in PNG tiles, the minimum of arr if None
+    @param max_limit: The value that becomes white in PNG tiles, the maximum of arr if None
+    @param bits: 16 or 8 bits per pixel for PNG tiles
+    @param threads: How many threads encode tiles, defaults to the number of cores
+    @return: Returns the manifest as a dict
+    '''
+    if fmt not in ('png', 'npy'):
+        raise Exception("Export Error: The tile format must be 'png' or 'npy'")
+    if fmt == 'png' and (min_limit is None or max_limit is None):
+        low, high = find_min_max(arr)
+        min_limit = float(low) if min_limit is None else min_limit
+        max_limit = float(high) if max_limit is None else max_limit
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    height, width = arr.shape
+    threads = threads if threads is not None else (os.cpu_count() or 1)
+    pattern = "tile_%d_%d." + fmt
+
+    def save_tile(tile, path):
+        if fmt == 'npy':
+            np.save(path, tile)
+            return
+        ok, encoded = cv2.imencode('.png', tile)
+        if not ok:
+            raise Exception("Export Error: The tile " + path + " couldn't be encoded")
+        with open(path, 'wb') as f:
+            f.write(encoded.tobytes())
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = []
+        for row, (start, band) in enumerate(iter_row_blocks(arr, tile_size)):
+            # Wait for the row before so only two rows of tiles are held at once
+            for future in futures:
+                future.result()
+            if fmt == 'png':
+                band = quantize(band, min_limit, max_limit, np.uint16 if bits == 16 else np.uint8)
+            futures = [pool.submit(save_tile, np.ascontiguousarray(band[:, col * tile_size:(col + 1) * tile_size]),
+                                   os.path.join(directory, pattern % (row, col)))
+                       for col in range(-(-width // tile_size))]
+        for future in futures:
+            future.result()
+
+    manifest = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'rows': -(-height // tile_size),
+        'columns': -(-width // tile_size),
+        'format': fmt,
+        'pattern': pattern,
+        'dtype': str(arr.dtype) if fmt == 'npy' else ('uint16' if bits == 16 else 'uint8'),
+        'min_limit': min_limit,
+        'max_limit': max_limit,
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def export_map(arr, path, **kwargs):
+    '''
+    Saves a map in the format that goes with the extension of path, .png, .npy or .npz
+    @param arr: The map
+    @param path: Where to save it
+    @param kwargs: Passed on to export_png, export_npy or export_npz
+    @return: Returns path
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.png':
+        return export_png(arr, path, **kwargs)
+    if extension == '.npy':
+        return export_npy(arr, path, **kwargs)
+    if extension == '.npz':
+        return export_npz(arr, path, **kwargs)
+    raise Exception("Export Error: Maps can be saved as .png, .npy or .npz")
@@ -1,12 +1,403 @@
 import cv2
 import math
 import numpy as np
+import collections
+import threading
+import hashlib
+import os
 
-def display_image(win_name, image):
+def display_image(win_name, image, wait=0):
+    '''
+    Shows an image in a window, for generators use a PreviewObserver from progress.py instead
+    @param win_name: The name of the window
+    @param image: The image to show
+    @param wait: How many milliseconds to wait for a key, 0 blocks until one is pressed
+    '''
     cv2.namedWindow(win_name, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(win_name, 800, 800)
     cv2.imshow(win_name, image)
-    cv2.waitKey(0)
+    cv2.waitKey(wait)
     
 def mean(list):
-    return sum(list) / len(list)
\ No newline at end of file
+    return sum(list) / len(list)
+    
+def find_min_max(arr, chunk_rows=256):
+    '''
+    Finds the minimum and maximum of an array in one pass over it, a block of rows at a time
+    @param arr: The array to look through
+    @param chunk_rows: How many rows to look at at once
+    @return: Returns the minimum and the maximum
+    '''
+    arr = np.asarray(arr)
+    if arr.ndim == 0:
+        return arr[()], arr[()]
+    low = None
+    high = None
+    for start in range(0, arr.shape[0], chunk_rows):
+        # The chunk is still in cache for the second reduction
+        chunk = arr[start:start + chunk_rows]
+        chunk_low = chunk.min()
+        chunk_high = chunk.max()
+        low = chunk_low if low is None else min(low, chunk_low)
+        high = chunk_high if high is None else max(high, chunk_high)
+    return low, high
+
+def normalize_in_place(arr, min_limit, max_limit, top=255):
+    '''
+    Clips, shifts and scales a float array in place so [min_limit, max_limit] becomes [0, top]
+    @param arr: The float array to normalize
+    @param min_limit: The minimum value for the intensities
+    @param max_limit: The maximum value for the intensities
+    @param top: The value max_limit gets mapped to
+    @return: Returns arr
+    '''
+    np.clip(arr, min_limit, max_limit, out=arr)
+    arr -= min_limit
+    if max_limit != min_limit:
+        arr *= top
+        arr /= (max_limit - min_limit)
+    return arr
+
+def quantize(arr, min_limit=None, max_limit=None, dtype=np.uint8, out=None, chunk_rows=256):
+    '''
+    Converts an array into integer color values a block of rows at a time
+    Only one block sized float buffer is used on top of the output so the peak memory stays close to the output size
+    @param arr: The array to convert, it is not changed
+    @param min_limit: The value that becomes 0, the minimum of arr if None
+    @param max_limit: The value that becomes the top of the dtype, the maximum of arr if None
+    @param dtype: The integer dtype of the output like np.uint8 or np.uint16
+    @param out: An optional array to write the output into, it has to have the shape of arr
+    @param chunk_rows: How many rows to convert at once
+    @return: Returns the converted array
+    '''
+    arr = np.asarray(arr)
+    if min_limit is None or max_limit is None:
+        low, high = find_min_max(arr, chunk_rows)
+        min_limit = low if min_limit is None else min_limit
+        max_limit = high if max_limit is None else max_limit
+
+    # Single values go through as a one element row
+    if arr.ndim == 0:
+        single_out = None if out is None else out.reshape(1)
+        return quantize(arr.reshape(1), min_limit, max_limit, dtype, single_out, chunk_rows).reshape(())
+
+    if out is None:
+        out = np.empty(arr.shape, dtype=dtype)
+    top = np.iinfo(out.dtype).max
+
+    buf_dtype = arr.dtype if arr.dtype.kind == 'f' else np.float64
+    buf = np.empty((min(chunk_rows, arr.shape[0]),) + arr.shape[1:], dtype=buf_dtype)
+    for start in range(0, arr.shape[0], chunk_rows):
+        chunk = arr[start:start + chunk_rows]
+        block = buf[:chunk.shape[0]]
+        block[...] = chunk
+        normalize_in_place(block, min_limit, max_limit, top)
+        # Casting to the integer dtype truncates like astype does
+        out[start:start + chunk.shape[0]] = block
+    return out
+
+def seed_to_int(seed):
+    '''
+    Turns a seed into a non negative int that numpy will accept
+    @param seed: An int or float seed
+    @return: Returns the seed as an int
+    '''
+    # SeedSequence only takes non negative ints, floats (like random.random()) are hashed which is stable for numbers
+    if isinstance(seed, float) and not seed.is_integer():
+        seed = hash(seed)
+    return int(seed) % (2**64)
+
+def derive_seed(seed, *keys):
+    '''
+    Derives a new independent seed from a seed and some integer keys, like the coordinates of a tile
+    @param seed: An int or float seed
+    @param keys: Integers that identify what the new seed is for, they can be negative
+    @return: Returns the derived seed as an int
+    '''
+    entropy = [seed_to_int(seed)] + [int(k) % (2**64) for k in keys]
+    return int(np.random.SeedSequence(entropy).generate_state(1, np.uint64)[0])
+    
+def make_rng(seed):
+    '''
+    Creates a numpy random Generator for the given seed
+    @param seed: An int or float seed, None for a random seed, or an existing Generator to reuse
+    @return: Returns a numpy.random.Generator
+    '''
+    if seed is None or isinstance(seed, np.random.Generator):
+        return np.random.default_rng(seed)
+    return np.random.default_rng(seed_to_int(seed))
+
+class RandomBlock():
+    
+    def __init__(self, rng, block_size=4096):
+        '''
+        Hands out single random numbers from a numpy Generator, drawing them in blocks to skip the per call overhead
+        @param rng: The numpy Generator to draw from
+        @param block_size: How many numbers to draw at a time
+        '''
+        self.rng = rng
+        self.block_size = block_size
+        self._block = []
+        self._index = 0
+    
+    def random(self):
+        '''
+        @return: Returns the next random float in [0, 1)
+        '''
+        if self._index >= len(self._block):
+            # A list of python floats is faster to hand out one at a time than a numpy array
+            self._block = self.rng.random(self.block_size).tolist()
+            self._index = 0
+        value = self._block[self._index]
+        self._index += 1
+        return value
+    
+    def uniform(self, low, high):
+        '''
+        @return: Returns the next random float in [low, high)
+        '''
+        return low + (high - low) * self.random()
+    
+    def randint(self, low, high):
+        '''
+        @return: Returns the next random int in [low, high)
+        '''
+        return low + int((high - low) * self.random())
+
+def allocate_map(shape, dtype=np.float64, store=None):
+    '''
+    Allocates the zero filled array a generator writes its map into
+    @param shape: The shape of the map
+    @param dtype: The dtype of the map when a new one is made, np.float32 halves the memory
+    @param store: None for an in memory array, the path of a file to memory map (.npy files get a header
+                  so np.load can open them), or an existing array like an np.memmap to fill in
+    @return: Returns the array
+    '''
+    if store is None:
+        return np.zeros(shape, dtype=dtype)
+    if isinstance(store, np.ndarray):
+        if store.shape != tuple(shape):
+            raise Exception("Store Error: The store has shape " + str(store.shape) + " but the map needs " + str(tuple(shape)))
+        store[...] = 0
+        return store
+    # New files are sparse so they start out as zeros without being written
+    if str(store).endswith('.npy'):
+        return np.lib.format.open_memmap(store, mode='w+', dtype=dtype, shape=tuple(shape))
+    return np.memmap(store, dtype=dtype, mode='w+', shape=tuple(shape))
+
+# The dtype to ask for to get a mask packed 8 pixels to a byte with np.packbits
+PACKED = 'packed'
+
+def pack_mask(mask):
+    '''
+    Packs a bool mask along its last axis, 8 pixels to a byte, the first pixel is the top bit
+    @param mask: The bool mask, True where something is drawn
+    @return: Returns the uint8 array, its last axis is ceil(width / 8) long
+    '''
+    return np.packbits(mask, axis=-1)
+
+def unpack_mask(packed, width):
+    '''
+    Unpacks a mask from pack_mask
+    @param packed: The packed mask
+    @param width: The width of the mask before it was packed
+    @return: Returns the bool mask
+    '''
+    return np.unpackbits(packed, axis=-1, count=width).view(bool)
+
+def mask_to_image(mask, dtype=np.uint8):
+    '''
+    Turns a mask into a white image with the mask drawn in black, the way the path and tower generators draw
+    @param mask: The bool mask
+    @param dtype: The dtype of the image
+    @return: Returns the image
+    '''
+    image = np.full(mask.shape, 255, dtype=dtype)
+    image[mask] = 0
+    return image
+
+def param_key(name, params):
+    '''
+    Hashes the parameters of a generator into a key for an OutputCache
+    Arrays are hashed by their dtype, shape and bytes, sequences item by item and everything else by its repr
+    @param name: The name of the generator
+    @param params: A dict of the parameters, it has to include the seed
+    @return: Returns the key as a hex string
+    '''
+    digest = hashlib.sha1(name.encode())
+    def feed(value):
+        if isinstance(value, np.ndarray):
+            digest.update(("array" + value.dtype.str + str(value.shape)).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            digest.update(("seq" + str(len(value))).encode())
+            for item in value:
+                feed(item)
+        elif isinstance(value, type) and issubclass(value, np.generic):
+            digest.update(np.dtype(value).str.encode())
+        else:
+            digest.update(repr(value).encode())
+    for key in sorted(params):
+        digest.update(("|" + key + "=").encode())
+        feed(params[key])
+    return digest.hexdigest()
+
+class OutputCache():
+
+    def __init__(self, max_bytes=1 << 28, directory=None):
+        '''
+        Keeps the outputs of generators around so the same map isn't generated twice
+        The least recently used outputs are dropped once they take up more than max_bytes,
+        with a directory every output is also saved as a .npz file and is found there after it's dropped
+        @param max_bytes: The most bytes of outputs to keep in memory
+        @param directory: Where to save the .npz files, None to only keep the outputs in memory
+        '''
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        '''
+        @return: Returns the path of the .npz file for key
+        '''
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        '''
+        @param key: The key from param_key
+        @return: Returns a copy of the output, None if it isn't in the cache
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key].copy()
+        if self.directory is None or not os.path.exists(self.path(key)):
+            return None
+        with np.load(self.path(key)) as data:
+            arr = data['output']
+        self._remember(key, arr)
+        return arr.copy()
+
+    def put(self, key, arr):
+        '''
+        Adds a copy of an output to the cache when it fits, and to the directory if there is one
+        @param key: The key from param_key
+        @param arr: The output
+        '''
+        arr = np.asarray(arr)
+        if self.directory is not None:
+            # Written to a temporary file first so a half written file is never found
+            temp = self.path(key) + ".%d.tmp" % os.getpid()
+            with open(temp, 'wb') as f:
+                np.savez(f, output=arr)
+            os.replace(temp, self.path(key))
+        # Only copied when it fits, a memory mapped output that is too big is never read into memory
+        if arr.nbytes <= self.max_bytes:
+            self._remember(key, np.array(arr))
+
+    def _remember(self, key, arr):
+        '''
+        Keeps arr in memory and drops the least recently used outputs until they fit
+        '''
+        if arr.nbytes > self.max_bytes:
+            return
+        arr.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = arr
+            self.nbytes += arr.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def clear(self):
+        '''
+        Drops every output kept in memory, the files in the directory are kept
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+class BaseGenerator():
+    '''
+    The API every generator shares: parameters and a seed go in, generate() makes the output and the output
+    property gives it back, generating it the first time it's asked for.
+    Subclasses call BaseGenerator.__init__ with everything that changes the output and implement build
+    '''
+
+    def __init__(self, seed, params, cache=None, store=None):
+        '''
+        @param seed: The seed for the random generation
+        @param params: A dict of every parameter that changes the output, other than the seed
+        @param cache: An OutputCache to look the output up in before generating it, None to always generate
+        @param store: Where the subclass keeps its output, a cached output is copied into it
+        '''
+        self.seed = seed
+        self.params = params
+        self.cache = cache
+        self.store = store
+        self._output = None
+
+    def build(self):
+        '''
+        Generates the output, implemented by every subclass
+        @return: Returns the output
+        '''
+        raise NotImplementedError
+
+    def cache_key(self):
+        '''
+        @return: Returns the key of the output in the cache, None when there's no seed since the output is random then
+        '''
+        if self.seed is None or isinstance(self.seed, np.random.Generator):
+            return None
+        return param_key(type(self).__name__, dict(self.params, seed=seed_to_int(self.seed)))
+
+    def generate(self):
+        '''
+        Generates the output, or takes it from the cache when the same parameters were generated before
+        @return: Returns the output
+        '''
+        key = self.cache_key() if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._output = self.restore(cached)
+                return self._output
+        self._output = self.build()
+        if key is not None:
+            self.cache.put(key, self._output)
+        return self._output
+
+    def restore(self, cached):
+        '''
+        Turns an output from the cache into this generator's output
+        @param cached: The copy of the output from the cache
+        @return: Returns the output
+        '''
+        if self.store is None:
+            return cached
+        out = allocate_map(cached.shape, cached.dtype, self.store)
+        out[...] = cached
+        return out
+
+    @property
+    def output(self):
+        if self._output is None:
+            self.generate()
+        return self._output
+
+    @output.setter
+    def output(self, value):
+        self._output = value
+
+    def get_output(self):
+        '''
+        @return: Returns the output, generating it if it hasn't been yet
+        '''
+        return self.output
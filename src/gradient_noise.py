@@ -0,0 +1,183 @@
+from general_functions import *
+import numpy as np
+
+# Gradient directions picked by the hash of a lattice point
+GRAD2 = np.array([[1, 1], [-1, 1], [1, -1], [-1, -1],
+                  [1, 0], [-1, 0], [0, 1], [0, -1]], dtype=np.float64)
+# The 12 edges of a cube, padded to 16 so the hash can be masked instead of taking a modulo
+GRAD3 = np.array([[1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0],
+                  [1, 0, 1], [-1, 0, 1], [1, 0, -1], [-1, 0, -1],
+                  [0, 1, 1], [0, -1, 1], [0, 1, -1], [0, -1, -1],
+                  [1, 1, 0], [-1, 1, 0], [0, -1, 1], [0, -1, -1]], dtype=np.float64)
+
+def fade(t):
+    '''
+    The smoothing curve 6t^5 - 15t^4 + 10t^3
+    @param t: The fractional part of the coordinates
+    @return: Returns the weights for interpolation
+    '''
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+def lerp(a, b, t):
+    return a + t * (b - a)
+
+class GradientNoise():
+
+    def __init__(self, seed=None):
+        '''
+        Constructor for the GradientNoise class, Perlin noise that can be sampled anywhere
+        @param seed: The seed for the permutation table
+        '''
+        perm = make_rng(seed).permutation(256)
+        # Doubled so lookups of the hash plus one never have to wrap
+        self.perm = np.concatenate([perm, perm]).astype(np.intp)
+
+    def perlin2(self, x, y):
+        '''
+        Samples 2D Perlin noise, the coordinates can be arrays of any matching shape
+        @param x: The x coordinates
+        @param y: The y coordinates
+        @return: Returns the noise values, roughly in [-1, 1]
+        '''
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        xf = np.floor(x)
+        yf = np.floor(y)
+        xi = xf.astype(np.intp) & 255
+        yi = yf.astype(np.intp) & 255
+        fx = x - xf
+        fy = y - yf
+
+        # Hash every corner of the lattice cell
+        p = self.perm
+        a = p[xi] + yi
+        b = p[xi + 1] + yi
+        aa = p[a] & 7
+        ab = p[a + 1] & 7
+        ba = p[b] & 7
+        bb = p[b + 1] & 7
+
+        # Dot product of every corner's gradient with the offset to it
+        gx = GRAD2[:, 0]
+        gy = GRAD2[:, 1]
+        n00 = gx[aa] * fx + gy[aa] * fy
+        n10 = gx[ba] * (fx - 1) + gy[ba] * fy
+        n01 = gx[ab] * fx + gy[ab] * (fy - 1)
+        n11 = gx[bb] * (fx - 1) + gy[bb] * (fy - 1)
+
+        u = fade(fx)
+        v = fade(fy)
+        return lerp(lerp(n00, n10, u), lerp(n01, n11, u), v)
+
+    def perlin3(self, x, y, z):
+        '''
+        Samples 3D Perlin noise, the coordinates can be arrays of any matching shape
+        @param x: The x coordinates
+        @param y: The y coordinates
+        @param z: The z coordinates
+        @return: Returns the noise values, roughly in [-1, 1]
+        '''
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                                      np.asarray(z, dtype=np.float64))
+        xf = np.floor(x)
+        yf = np.floor(y)
+        zf = np.floor(z)
+        xi = xf.astype(np.intp) & 255
+        yi = yf.astype(np.intp) & 255
+        zi = zf.astype(np.intp) & 255
+        fx = x - xf
+        fy = y - yf
+        fz = z - zf
+
+        p = self.perm
+        a = p[xi] + yi
+        b = p[xi + 1] + yi
+        aa = p[a] + zi
+        ab = p[a + 1] + zi
+        ba = p[b] + zi
+        bb = p[b + 1] + zi
+
+        def corner(h, dx, dy, dz):
+            h = p[h] & 15
+            return GRAD3[h, 0] * dx + GRAD3[h, 1] * dy + GRAD3[h, 2] * dz
+
+        u = fade(fx)
+        v = fade(fy)
+        w = fade(fz)
+        near = lerp(lerp(corner(aa, fx, fy, fz), corner(ba, fx - 1, fy, fz), u),
+                    lerp(corner(ab, fx, fy - 1, fz), corner(bb, fx - 1, fy - 1, fz), u), v)
+        far = lerp(lerp(corner(aa + 1, fx, fy, fz - 1), corner(ba + 1, fx - 1, fy, fz - 1), u),
+                   lerp(corner(ab + 1, fx, fy - 1, fz - 1), corner(bb + 1, fx - 1, fy - 1, fz - 1), u), v)
+        return lerp(near, far, w)
+
+    def fbm2(self, x, y, octaves=6, lacunarity=2.0, gain=0.5):
+        '''
+        Fractal Brownian motion, layers of 2D noise at rising frequency and falling amplitude
+        @param x: The x coordinates
+        @param y: The y coordinates
+        @param octaves: How many layers to add up
+        @param lacunarity: How much the frequency grows each octave
+        @param gain: How much the amplitude shrinks each octave
+        @return: Returns the noise values, roughly in [-1, 1]
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        total = np.zeros(np.broadcast(x, y).shape)
+        freq = 1.0
+        amp = 1.0
+        amp_sum = 0.0
+        for octave in range(octaves):
+            total += amp * self.perlin2(x * freq, y * freq)
+            amp_sum += amp
+            freq *= lacunarity
+            amp *= gain
+        total /= amp_sum
+        return total
+
+    def fbm3(self, x, y, z, octaves=6, lacunarity=2.0, gain=0.5):
+        '''
+        Fractal Brownian motion, layers of 3D noise at rising frequency and falling amplitude
+        @param x: The x coordinates
+        @param y: The y coordinates
+        @param z: The z coordinates
+        @param octaves: How many layers to add up
+        @param lacunarity: How much the frequency grows each octave
+        @param gain: How much the amplitude shrinks each octave
+        @return: Returns the noise values, roughly in [-1, 1]
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+        total = np.zeros(np.broadcast(x, y, z).shape)
+        freq = 1.0
+        amp = 1.0
+        amp_sum = 0.0
+        for octave in range(octaves):
+            total += amp * self.perlin3(x * freq, y * freq, z * freq)
+            amp_sum += amp
+            freq *= lacunarity
+            amp *= gain
+        total /= amp_sum
+        return total
+
+    def sample_grid(self, x0, y0, width, height, scale, octaves=6, lacunarity=2.0, gain=0.5):
+        '''
+        Samples a rectangle of fBm noise on the integer grid, only the rectangle is computed
+        so any region of the endless noise can be sampled on its own
+        @param x0: The x coordinate of the left column
+        @param y0: The y coordinate of the top row
+        @param width: How many columns to sample
+        @param height: How many rows to sample
+        @param scale: The size of a grid cell in noise coordinates, smaller is smoother
+        @param octaves: How many layers to add up
+        @param lacunarity: How much the frequency grows each octave
+        @param gain: How much the amplitude shrinks each octave
+        @return: Returns a (height, width) array of noise values
+        '''
+        xs = (np.arange(width) + x0) * scale
+        ys = (np.arange(height) + y0) * scale
+        return self.fbm2(xs[np.newaxis, :], ys[:, np.newaxis], octaves, lacunarity, gain)
+
+if __name__ == '__main__':
+    noise = GradientNoise(1234)
+    field = noise.sample_grid(0, 0, 512, 512, 1 / 128.0)
+    display_image("Noise", ((field + 1) * 127.5).clip(0, 255).astype(np.uint8))
@@ -0,0 +1,122 @@
+from general_functions import *
+import logging
+import threading
+import time
+import numpy as np
+
+class ProgressObserver():
+    '''
+    Generators report their progress and intermediate images to an observer instead of printing or drawing.
+    This base class ignores everything so it costs nothing, subclasses pick what to do with the reports
+    '''
+
+    def progress(self, task, done, total):
+        '''
+        Called when a generator finishes a unit of work, like a level or a row
+        @param task: The name of what is being generated
+        @param done: How many units are done
+        @param total: How many units there are
+        '''
+        pass
+
+    def preview(self, task, image):
+        '''
+        Called with the current state of the image, it must not be kept since the generator keeps changing it
+        @param task: The name of what is being generated
+        @param image: The image so far
+        '''
+        pass
+
+    def close(self):
+        '''
+        Frees anything the observer is holding on to
+        '''
+        pass
+
+# Shared by every generator that isn't given an observer
+NULL_OBSERVER = ProgressObserver()
+
+class LoggingObserver(ProgressObserver):
+
+    def __init__(self, interval=1.0, logger=None):
+        '''
+        Logs progress, at most once every interval seconds per task plus once when a task is done
+        @param interval: The minimum number of seconds between two messages for a task
+        @param logger: The logger to use, defaults to the 'procedural_generation' logger
+        '''
+        self.interval = interval
+        self.logger = logger if logger is not None else logging.getLogger('procedural_generation')
+        self._last = {}
+
+    def progress(self, task, done, total):
+        now = time.time()
+        if done < total and now - self._last.get(task, 0) < self.interval:
+            return
+        self._last[task] = now
+        self.logger.info("%s: %d/%d", task, done, total)
+
+class PreviewObserver(ProgressObserver):
+
+    def __init__(self, win_name="Preview", max_fps=10, max_size=512):
+        '''
+        Shows the latest preview image in a window that is drawn by its own thread, so generating never waits on it
+        @param win_name: The name of the window
+        @param max_fps: The most frames per second to copy and draw
+        @param max_size: Images are decimated until neither side is bigger than this before they are copied
+        '''
+        self.win_name = win_name
+        self.max_fps = max_fps
+        self.max_size = max_size
+        self._frame = None
+        self._last = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._draw_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def preview(self, task, image):
+        # Only pay for the copy when the frame will actually be drawn
+        now = time.time()
+        if now - self._last < 1.0 / self.max_fps:
+            return
+        self._last = now
+        step = max(1, -(-max(image.shape[:2]) // self.max_size))
+        frame = np.array(image[::step, ::step])
+        with self._lock:
+            self._frame = frame
+
+    def _draw_loop(self):
+        '''
+        Draws the newest frame until the observer is closed
+        '''
+        cv2.namedWindow(self.win_name, cv2.WINDOW_NORMAL)
+        while not self._stop.is_set():
+            with self._lock:
+                frame = self._frame
+                self._frame = None
+            if frame is not None:
+                if frame.dtype != np.uint8:
+                    frame = quantize(frame)
+                cv2.imshow(self.win_name, frame)
+            cv2.waitKey(max(1, int(1000 / self.max_fps)))
+        cv2.destroyWindow(self.win_name)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+def make_observer(backend=None, **kwargs):
+    '''
+    Makes an observer by name
+    @param backend: None or 'none' to ignore progress, 'log' for throttled logging, 'preview' for a preview window
+    @param kwargs: Passed on to the observer's constructor
+    @return: Returns the observer
+    '''
+    if backend is None or backend == 'none':
+        return NULL_OBSERVER
+    if backend == 'log':
+        return LoggingObserver(**kwargs)
+    if backend == 'preview':
+        return PreviewObserver(**kwargs)
+    raise Exception("Observer Error: The backend must be 'none', 'log' or 'preview'")
@@ -1,77 +1,250 @@
+from general_functions import *
+from progress import NULL_OBSERVER
 import numpy as np
-import cv2
 
-class RandomPathGen():
+# How u and v change for every direction, 0 is down, 1 is right, 2 is up and 3 is left
+DIRECTION_DU = (0, 1, 0, -1)
+DIRECTION_DV = (1, 0, -1, 0)
+
+class RandomPathGen(BaseGenerator):
     
-    def __init__(self, size):
+    def __init__(self, size, seed=None, observer=None, cache=None, dtype=np.float64):
+        '''
+        Constructor for the RandomPathGen class, the image is a white canvas the paths are drawn on in black
+        generate() and the output draw the path from draw_line, the other draw methods add more paths to the image
+        @param size: The square size of the image
+        @param seed: The seed for the random generation
+        @param observer: A ProgressObserver that gets told about every step, nothing is reported by default
+        @param cache: An OutputCache to take the path from when it was drawn before, None to always draw it
+        @param dtype: The dtype of the image, np.uint8 holds the same 0/255 image in an eighth of the memory.
+                      PACKED draws on a bool mask of the paths instead and the output is the mask packed
+                      8 pixels to a byte (see pack_mask), 64 times smaller than the float64 image
+        '''
+        packed = isinstance(dtype, str) and dtype == PACKED
+        BaseGenerator.__init__(self, seed, {'size': size, 'dtype': PACKED if packed else np.dtype(dtype).str}, cache)
         self.size = size
-        self.image = np.zeros((size,size))
-        self.image[self.image == 0] = 255
+        # Progress and the path so far are reported here instead of being drawn every step
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        # Each path has its own random number generator, seeding it makes the path reproducible
+        self.rng = make_rng(seed)
+        self.draws = RandomBlock(self.rng)
+        self.packed = packed
+        # The value of the drawn pixels, black on the white image or True on the mask
+        if packed:
+            self.image = np.zeros((size, size), dtype=bool)
+            self.ink = True
+        else:
+            self.image = np.full((size, size), 255, dtype=dtype)
+            self.ink = 0
         self.invalid_counter = 0
+    
+    def build(self):
+        '''
+        Draws the path from draw_line on the canvas
+        @return: Returns the image, or the packed mask
+        '''
+        self.draw_line()
+        if self.packed:
+            return pack_mask(self.image)
+        return self.image
+    
+    def restore(self, cached):
+        # The canvas is kept so the other draw methods keep drawing on the cached path
+        if self.packed:
+            self.image[...] = unpack_mask(cached, self.size)
+            return cached
+        self.image[...] = cached
+        return self.image
         
     def draw_line(self):
+        '''
+        Draws a self avoiding path one step at a time starting from the top left corner
+        It stops after size steps or when the path gets stuck
+        '''
         last_direction = 0
-        cv2.namedWindow("Test", cv2.WINDOW_NORMAL)
+        u, v = 0, 0
+        self.image[v, u] = self.ink
         for iter in range(self.size):
-            nu, nv, last_direction = self.find_point(0, 0, last_direction)
+            nu, nv, last_direction = self.find_point(u, v, last_direction)
             if last_direction == -1:
                 break
-            self.image[nv, nu] = 0
-            cv2.imshow("Test", self.image)
-            cv2.waitKey(1)
-        pass
+            self.image[nv, nu] = self.ink
+            u, v = nu, nv
+            self.observer.progress("random_path", iter + 1, self.size)
+            self.observer.preview("random_path", self.image)
     
     def find_point(self, u, v, last_direction):
         nu, nv, new_direction = self.pick_next_point(u, v, last_direction)
         invalid_counter = 0
         while not(self.is_valid(nu, nv)):
-            nu, nv, new_direction = self.pick_next_point(u, v, last_direction)
+            invalid_counter += 1
+            self.invalid_counter += 1
             if invalid_counter == 100:
                 return -1, -1, -1
+            nu, nv, new_direction = self.pick_next_point(u, v, last_direction)
             
         return nu, nv, new_direction
+    
     def pick_next_point(self, u, v, last_direction):
         
-        new_direction = np.random.randint(0, 4)
+        new_direction = self.draws.randint(0, 4)
         new_direction = (last_direction + new_direction) % 4
         
-        nu = None
-        nv = None
-        
-        if new_direction == 0:
-            nu = u
-            nv = v + 1
-        elif new_direction == 1:
-            nu = u + 1
-            nv = v
-        elif new_direction == 2:
-            nu = u
-            nv = v - 1
-        elif new_direction == 3:
-            nu = u - 1
-            nv = v
+        nu = u + DIRECTION_DU[new_direction]
+        nv = v + DIRECTION_DV[new_direction]
         return nu, nv, new_direction
     
-    
     def is_valid(self, nu, nv):
         if nv < 0 or nu < 0 or nv > self.size - 1 or nu > self.size - 1:
             return False
-        if self.image[nv, nu] == 0:
+        if self.image[nv, nu] == self.ink:
             return False
         else:
             return True
+    
+    def draw_walks(self, starts, max_steps=None):
+        '''
+        Draws many self avoiding paths at once, the paths also avoid each other and everything already drawn
+        @param starts: A list of (u, v) start points, one for every walker
+        @param max_steps: The most steps any walker takes, they all keep going until stuck when None
+        @return: Returns a list with a (length, 2) array of (u, v) points for every walker
+        '''
+        # The mask is walked on as it is, the image needs a mask of it that is drawn back afterwards
+        if self.packed:
+            return self_avoiding_walks(self.image, starts, max_steps, self.rng, self.observer)
+        blocked = self.image == 0
+        paths = self_avoiding_walks(blocked, starts, max_steps, self.rng, self.observer)
+        self.image[blocked] = 0
+        return paths
+    
+    def draw_random_walk(self, start, steps):
+        '''
+        Draws one long random walk that is allowed to cross itself, it bounces off the edges of the image
+        @param start: The (u, v) start point
+        @param steps: How many steps to take
+        @return: Returns a (steps + 1, 2) array of (u, v) points
+        '''
+        path = random_walk(self.size, start, steps, self.rng)
+        self.image[path[:, 1], path[:, 0]] = self.ink
+        return path
+
+def self_avoiding_walks(blocked, starts, max_steps, rng, observer=NULL_OBSERVER):
+    '''
+    Moves many walkers at once over one grid, every step each walker picks one of its free neighbours at random.
+    A walker stops when all of its neighbours are blocked, when two walkers want the same cell the first one gets it
+    and the other one tries again on the next step
+    @param blocked: A (size, size) bool grid of the cells that can't be walked on, the paths get added to it
+    @param starts: A list of (u, v) start points, one for every walker
+    @param max_steps: The most steps any walker takes, None to keep going until every walker is stuck
+    @param rng: The numpy Generator to draw from
+    @param observer: A ProgressObserver that gets told how many walkers have stopped after every step
+    @return: Returns a list with a (length, 2) array of (u, v) points for every walker
+    '''
+    size = blocked.shape[0]
+    width = size + 2
+    
+    # A blocked border around the grid means the neighbours never need a bounds check
+    grid = np.ones((width, width), dtype=bool)
+    grid[1:-1, 1:-1] = blocked
+    flat = grid.ravel()
+    offsets = np.array(DIRECTION_DV) * width + np.array(DIRECTION_DU)
+    
+    starts = np.asarray(starts, dtype=np.intp).reshape(-1, 2)
+    pos = (starts[:, 1] + 1) * width + (starts[:, 0] + 1)
+    flat[pos] = True
+    
+    # Every step is recorded for every walker, -1 once a walker has stopped
+    history = [pos.copy()]
+    active = np.arange(len(pos))
+    step = 0
+    while len(active) and (max_steps is None or step < max_steps):
+        step += 1
+        candidates = pos[active, np.newaxis] + offsets
+        free = ~flat[candidates]
         
+        # A random key for every direction, the free one with the biggest key is picked
+        keys = rng.random(candidates.shape)
+        keys[~free] = -1
+        choice = keys.argmax(axis=1)
+        moving = free.any(axis=1)
+        targets = candidates[np.arange(len(active)), choice]
         
+        # Only the first walker that wants a cell gets it
+        _, first = np.unique(np.where(moving, targets, -1 - np.arange(len(active))), return_index=True)
+        winners = np.zeros(len(active), dtype=bool)
+        winners[first] = True
+        winners &= moving
         
+        flat[targets[winners]] = True
+        pos[active[winners]] = targets[winners]
+        record = np.full(len(pos), -1, dtype=np.intp)
+        record[active] = pos[active]
+        record[active[~moving]] = -1
+        history.append(record)
+        active = active[moving]
+        observer.progress("random_walks", len(pos) - len(active), len(pos))
+    
+    blocked[...] = grid[1:-1, 1:-1]
+    
+    # Turn the flat indexes back into (u, v) points, dropping repeats from walkers that had to wait
+    history = np.array(history)
+    paths = []
+    for walker in range(history.shape[1]):
+        steps = history[:, walker]
+        steps = steps[steps >= 0]
+        steps = steps[np.concatenate([[True], steps[1:] != steps[:-1]])]
+        paths.append(np.stack([steps % width - 1, steps // width - 1], axis=1))
+    return paths
 
+def random_walk(size, start, steps, rng):
+    '''
+    Makes a random walk that can cross itself in one go, every step is drawn at once and summed up.
+    Folding the sums back into the grid bounces the walk off the edges and keeps every step one cell long
+    @param size: The square size of the grid
+    @param start: The (u, v) start point
+    @param steps: How many steps to take
+    @param rng: The numpy Generator to draw from
+    @return: Returns a (steps + 1, 2) array of (u, v) points
+    '''
+    path = walk_directions(start, rng.integers(0, 4, size=steps))
+    if size > 1:
+        period = 2 * (size - 1)
+        np.mod(path, period, out=path)
+        np.subtract(period, path, out=path, where=path > size - 1)
+    else:
+        path[...] = 0
+    return path
 
+def directed_walk(start, end, rng):
+    '''
+    Makes a random walk from start to end that only ever steps towards the end, in a random order
+    @param start: The (u, v) start point
+    @param end: The (u, v) end point
+    @param rng: The numpy Generator to draw from
+    @return: Returns an array of (u, v) points from start to end
+    '''
+    du = end[0] - start[0]
+    dv = end[1] - start[1]
+    directions = np.repeat([1 if du > 0 else 3, 0 if dv > 0 else 2], [abs(du), abs(dv)])
+    rng.shuffle(directions)
+    return walk_directions(start, directions)
 
-
+def walk_directions(start, directions):
+    '''
+    Turns a list of directions into the points of the walk
+    @param start: The (u, v) start point
+    @param directions: The direction of every step
+    @return: Returns a (len(directions) + 1, 2) array of (u, v) points
+    '''
+    path = np.empty((len(directions) + 1, 2), dtype=np.intp)
+    path[0] = start
+    path[1:, 0] = np.take(DIRECTION_DU, directions)
+    path[1:, 1] = np.take(DIRECTION_DV, directions)
+    np.cumsum(path, axis=0, out=path)
+    return path
 
 if __name__ == '__main__':
     size = 50
     rpgen = RandomPathGen(size)
-    rpgen.draw_line()
-    cv2.namedWindow("Test", cv2.WINDOW_NORMAL)
-    cv2.imshow("Test", rpgen.image)
+    display_image("Test", rpgen.output)
     
\ No newline at end of file
@@ -1,36 +1,163 @@
 from __future__ import print_function
 from general_functions import *
+from progress import NULL_OBSERVER
 import numpy as np
-import cv2
-import random
 
-class TowerMaker():
+class TowerMaker(BaseGenerator):
     
-    def __init__(self, sq_size, thick):
+    def __init__(self, sq_size, thick, seed=None, engine='loop', observer=None, cache=None, lazy=False, dtype=np.uint8):
+        '''
+        Constructor for the TowerMaker class
+        @param sq_size: The square size of the image
+        @param thick: The thickness of the base of the tower
+        @param seed: The seed for the random generation
+        @param engine: 'loop' to go through every pixel in python, 'numpy' to do each row at once
+        @param observer: A ProgressObserver that gets told about every finished row, nothing is reported by default
+        @param cache: An OutputCache to take the tower from when it was made before, None to always make it
+        @param lazy: Whether to wait until the image is asked for to make the tower, it's made right away by default
+        @param dtype: The dtype of the image, or PACKED for a mask of the tower packed 8 pixels to a byte (see pack_mask).
+                      The numpy engine grows a packed tower a row at a time without ever unpacking all of it
+        '''
+        if engine not in ('loop', 'numpy'):
+            raise Exception("Engine Error: It must be either 'loop' or 'numpy'")
+        self.packed = isinstance(dtype, str) and dtype == PACKED
+        BaseGenerator.__init__(self, seed, {'sq_size': sq_size, 'thick': thick, 'engine': engine,
+                                            'dtype': PACKED if self.packed else np.dtype(dtype).str}, cache)
         self.sq_size = sq_size
         self.thick = thick
-        self.image = np.full((sq_size,sq_size), 255, dtype=np.uint8)
+        self.engine = engine
+        self.dtype = dtype
+        # The value of the tower's pixels, black on the image or True on a bool mask and the mask the loop engine draws a packed tower on
+        self.ink = True if self.packed or np.dtype(dtype) == bool else 0
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        # Each tower has its own random number generator, seeding it makes the tower reproducible
+        self.rng = make_rng(seed)
+        self.draws = RandomBlock(self.rng)
+        if not lazy:
+            self.generate()
+    
+    @property
+    def image(self):
+        return self.output
+    
+    def build(self):
+        '''
+        Makes the tower on a new white image
+        @return: Returns the image, or the packed mask
+        '''
+        if self.packed and self.engine == 'loop':
+            self._output = new_towers(1, self.sq_size, self.thick, bool)[0]
+            self.generate_tower(self.sq_size, self.thick)
+            return pack_mask(self._output)
+        self._output = new_towers(1, self.sq_size, self.thick, self.dtype)[0]
         self.generate_tower(self.sq_size, self.thick)
+        return self._output
         
     def generate_tower(self, sq_size, thick):
-        start = (sq_size // 2) - (thick // 2)
-        end = (sq_size // 2) + (thick // 2)
-        self.image[0,start:end] = 0
+        if self.engine == 'numpy':
+            # A batch of one tower, the random values are used in the same order as the loop so the towers match
+            grow_towers(self.image[np.newaxis], thick, self.rng, self.observer, self.packed)
+            return
         for row_num in range(1, sq_size):
             self.generate_layer(row_num)
+            self.observer.progress("tower", row_num, sq_size - 1)
+            self.observer.preview("tower", self.image)
             
     def generate_layer(self, row_num):
+        image = self._output
         for index in range(self.sq_size):
-            random_num = int(random.uniform(1,10))
-            secondary = int(random.uniform(1,100))
-            main = random.uniform(1,10) * (index / self.thick) 
-            print("row: ", row_num, "/", self.sq_size)
-            if self.image[row_num - 1, index] == 0:
+            random_num = int(self.draws.uniform(1,10))
+            secondary = int(self.draws.uniform(1,100))
+            main = self.draws.uniform(1,10) * (index / self.thick) 
+            if image[row_num - 1, index] == self.ink:
                 if random_num != 10 and main >= 3:
-                    self.image[row_num, index] = 0
+                    image[row_num, index] = self.ink
             else:
                 if random_num == 3 and secondary % 10 == 0 and secondary % 3 == 0:
-                    self.image[row_num, index] = 0
+                    image[row_num, index] = self.ink
+
+def new_towers(count, sq_size, thick, dtype=np.uint8):
+    '''
+    Makes a batch of white images with the bases of the towers drawn on their first rows
+    @param count: How many towers
+    @param sq_size: The square size of each image
+    @param thick: The thickness of the base of the towers
+    @param dtype: The dtype of the images, bool for masks that are True on the towers or PACKED for packed masks
+    @return: Returns the (count, sq_size, sq_size) batch, the last axis is ceil(sq_size / 8) long when packed
+    '''
+    start = (sq_size // 2) - (thick // 2)
+    end = (sq_size // 2) + (thick // 2)
+    if isinstance(dtype, str) and dtype == PACKED:
+        base = np.zeros(sq_size, dtype=bool)
+        base[start:end] = True
+        images = np.zeros((count, sq_size, (sq_size + 7) // 8), dtype=np.uint8)
+        images[:, 0] = pack_mask(base)
+        return images
+    if np.dtype(dtype) == bool:
+        images = np.zeros((count, sq_size, sq_size), dtype=bool)
+        images[:, 0, start:end] = True
+        return images
+    images = np.full((count, sq_size, sq_size), 255, dtype=dtype)
+    images[:, 0, start:end] = 0
+    return images
+
+def grow_towers(images, thick, rng, observer=NULL_OBSERVER, packed=False):
+    '''
+    Grows every tower in a batch from its first row down, one row of every tower at a time.
+    Uses the same rules as TowerMaker.generate_layer, a black pixel stays black when random_num != 10 and main >= 3,
+    a white one turns black when random_num == 3 and secondary is divisible by 10 and 3
+    @param images: The (count, size, size) batch of towers with their first rows set, like one from new_towers
+    @param thick: The thickness of the base of the towers
+    @param rng: The numpy Generator to draw from
+    @param observer: A ProgressObserver that gets told about every finished row
+    @param packed: Whether images are packed masks, only the row above is unpacked to grow each row.
+                   A batch of bool images is grown as masks that are True on the towers
+    @return: Returns images
+    '''
+    count, rows = images.shape[:2]
+    cols = rows if packed else images.shape[2]
+    # Bool masks are True on the towers like packed ones, images are black on them
+    mask = packed or images.dtype == bool
+    # How much main gets scaled by for every column
+    col_scale = np.arange(cols) / thick
+    for row_num in range(1, rows):
+        # random_num, secondary and main for every pixel of the row
+        draws = rng.random((count, cols, 3))
+        random_num = (1 + 9 * draws[..., 0]).astype(np.int64)
+        secondary = (1 + 99 * draws[..., 1]).astype(np.int64)
+        main = (1 + 9 * draws[..., 2]) * col_scale
+        
+        if packed:
+            above_black = unpack_mask(images[:, row_num - 1], cols)
+        elif mask:
+            above_black = images[:, row_num - 1]
+        else:
+            above_black = images[:, row_num - 1] == 0
+        stays_black = (random_num != 10) & (main >= 3)
+        turns_black = (random_num == 3) & (secondary % 10 == 0) & (secondary % 3 == 0)
+        black = np.where(above_black, stays_black, turns_black)
+        if packed:
+            images[:, row_num] = pack_mask(black)
+        elif mask:
+            images[:, row_num] = black
+        else:
+            images[:, row_num][black] = 0
+        observer.progress("tower", row_num, rows - 1)
+        observer.preview("tower", images[0])
+    return images
+
+def generate_towers(count, sq_size, thick, seed=None, dtype=np.uint8):
+    '''
+    Generates many towers at once as a 3D batch
+    @param count: How many towers to make
+    @param sq_size: The square size of each image
+    @param thick: The thickness of the base of the towers
+    @param seed: The seed for the random generation
+    @param dtype: The dtype of the images, or PACKED for packed masks of the towers
+    @return: Returns a (count, sq_size, sq_size) array of towers, the last axis is ceil(sq_size / 8) long when packed
+    '''
+    images = new_towers(count, sq_size, thick, dtype)
+    return grow_towers(images, thick, make_rng(seed), packed=isinstance(dtype, str) and dtype == PACKED)
 
 if __name__ == '__main__':
     sq_size = 500
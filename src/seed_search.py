@@ -0,0 +1,282 @@
+from __future__ import print_function
+
+from general_functions import *
+from diamond_square_algo_alt import DiamondSquareGenerator
+from diamond_square_plan import is_square_size
+from diamond_square_lod import corner_grid, refine_level
+from progress import NULL_OBSERVER
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import numpy as np
+import time
+
+class Constraint():
+    '''
+    A limit on one statistic of a map. The statistics work on any level of a block engine map, a level is every
+    (size - 1) / 2^level th point of the full map, so they can be checked on a cheap coarse level first.
+    The finer levels still move the statistic, slack is how far past the limits a coarse level can be and still be refined.
+    A slack of None is measured by SeedSearch on the first seeds it tries
+    '''
+
+    def __init__(self, at_least=None, at_most=None, slack=0.0):
+        '''
+        @param at_least: The smallest value the statistic of the full map may have, None for no limit
+        @param at_most: The biggest value the statistic of the full map may have, None for no limit
+        @param slack: How far past the limits the statistic of a coarse level may be, None to measure it
+        '''
+        self.at_least = at_least
+        self.at_most = at_most
+        self.slack = slack
+
+    def statistic(self, grids):
+        '''
+        Works out the statistic, implemented by every subclass
+        @param grids: A (..., h, w) batch of maps or levels of maps
+        @return: Returns the statistic of every map in the batch
+        '''
+        raise NotImplementedError
+
+    def passes(self, grids, coarse=False):
+        '''
+        @param grids: A (..., h, w) batch of maps or levels of maps
+        @param coarse: Whether the grids are coarse levels, they are then given the slack
+        @return: Returns a bool for every map in the batch
+        '''
+        values = self.statistic(grids)
+        slack = self.slack if coarse else 0
+        ok = np.ones(np.shape(values), dtype=bool)
+        if self.at_least is not None:
+            ok &= values >= self.at_least - slack
+        if self.at_most is not None:
+            ok &= values <= self.at_most + slack
+        return ok
+
+class WaterFraction(Constraint):
+
+    def __init__(self, water_level, at_least=None, at_most=None, slack=None):
+        '''
+        A limit on how much of the map is under water
+        @param water_level: The height of the water
+        @param at_least: The smallest fraction from 0 to 1 of the points that may be under water
+        @param at_most: The biggest fraction that may be under water
+        @param slack: How far off the fraction of a coarse level may be, None to measure it
+        '''
+        Constraint.__init__(self, at_least, at_most, slack)
+        self.water_level = water_level
+
+    def statistic(self, grids):
+        return np.mean(grids < self.water_level, axis=(-2, -1))
+
+class Peak(Constraint):
+
+    def __init__(self, at_least=None, at_most=None, slack=0.0):
+        '''
+        A limit on the highest point of the map
+        The highest point of a coarse level is also a point of the full map so the full map's peak is never lower.
+        A coarse level over at_most can be dropped without any slack, an at_least limit is only checked on the full map
+        @param at_least: The lowest the highest point may be
+        @param at_most: The highest the highest point may be
+        @param slack: How far over at_most the peak of a coarse level may be
+        '''
+        Constraint.__init__(self, at_least, at_most, slack)
+
+    def statistic(self, grids):
+        return np.max(grids, axis=(-2, -1))
+
+    def passes(self, grids, coarse=False):
+        if not coarse:
+            return Constraint.passes(self, grids)
+        values = self.statistic(grids)
+        if self.at_most is None:
+            return np.ones(np.shape(values), dtype=bool)
+        return values <= self.at_most + self.slack
+
+class CornerBasins(Constraint):
+
+    def __init__(self, depth, corner=.125, slack=None):
+        '''
+        Wants every corner of the map to be a basin, the mean of every corner patch has to be at least depth
+        below the mean of the whole map
+        @param depth: How far below the mean of the map every corner has to be
+        @param corner: How much of the side of the map a corner patch covers, from 0 to .5
+        @param slack: How far off the depth of a coarse level may be, None to measure it
+        '''
+        Constraint.__init__(self, None, -depth, slack)
+        self.corner = corner
+
+    def statistic(self, grids):
+        h, w = grids.shape[-2:]
+        # Every patch has at least one point so the coarsest levels still have corners
+        ph = max(1, int(round(h * self.corner)))
+        pw = max(1, int(round(w * self.corner)))
+        patches = [grids[..., :ph, :pw], grids[..., :ph, -pw:], grids[..., -ph:, :pw], grids[..., -ph:, -pw:]]
+        highest = np.max([np.mean(patch, axis=(-2, -1)) for patch in patches], axis=0)
+        return highest - np.mean(grids, axis=(-2, -1))
+
+def batch_coarse_levels(seeds, size, min_val, max_val, level, border=None):
+    '''
+    Generates a coarse level of the block engine maps of many seeds at once, every step of every level is done by
+    refine_level on the whole (seeds, h, w) batch. The values are the same as DiamondSquareGenerator.coarse_map
+    @param seeds: The seeds of the maps
+    @param size: The size of the full maps, it must follow 'size = 2^n + 1'
+    @param min_val: The minimum value of the height maps
+    @param max_val: The maximum value of the height maps
+    @param level: The level to stop at
+    @param border: Optional (top, bottom, left, right) fixed border of the maps
+    @return: Returns a (seeds, 2^level + 1, 2^level + 1) float64 array
+    '''
+    block_seeds = [seed_to_int(seed) for seed in seeds]
+    grid = np.stack([corner_grid(seed, size, min_val, max_val, border) for seed in block_seeds])
+    for lv in range(1, level + 1):
+        grid = refine_level(grid, (0, 0), lv, size, block_seeds, max_val, border)
+    return grid
+
+def refine_candidate(seed, size, min_val, max_val, roughness, border, dtype, constraints):
+    '''
+    Generates the full map of a seed that made it past the coarse checks and checks it, run in a worker process
+    @return: Returns the seed, whether it passed, the map (None when it didn't pass) and the statistic of every constraint
+    '''
+    output = DiamondSquareGenerator(seed, size, min_val, max_val, roughness, engine='block', border=border, dtype=dtype).output
+    ok = all(bool(constraint.passes(output)) for constraint in constraints)
+    values = [float(constraint.statistic(output)) for constraint in constraints]
+    return seed, ok, output if ok else None, values
+
+class SeedSearch():
+
+    def __init__(self, size, min_val, max_val, constraints, roughness=.4, coarse_level=5, border=None, dtype=np.float64,
+                 workers=1, batch=256, calibration=8, margin=1.5, observer=None):
+        '''
+        Constructor for the SeedSearch class, it looks for the seeds whose maps meet every constraint.
+        The coarse level of a whole batch of seeds is generated at once and the seeds whose coarse levels miss a
+        constraint by more than its slack are dropped, only the rest get their full maps generated. The maps are the
+        ones DiamondSquareGenerator makes for the seed with the 'block' engine
+        @param size: The size of the maps, it must follow 'size = 2^n + 1'
+        @param min_val: The minimum value of the height maps
+        @param max_val: The maximum value of the height maps
+        @param constraints: A list of Constraint, like WaterFraction, Peak or CornerBasins
+        @param roughness: Value between 1 and 0 reflects the smoothness between cells
+        @param coarse_level: The level the seeds are checked on before their full maps are made, higher is slower
+                             but closer to the full map
+        @param border: Optional (top, bottom, left, right) fixed border of the maps
+        @param dtype: The dtype of the full maps
+        @param workers: How many processes generate full maps, 1 generates them in this process
+        @param batch: How many seeds have their coarse levels generated at once
+        @param calibration: How many of the first seeds get their full maps generated to measure the slack of the
+                            constraints that don't have one, they are checked like any other seed
+        @param margin: What the biggest difference between the coarse and full statistics of those seeds is multiplied
+                       by to get the slack
+        @param observer: A ProgressObserver that gets told how many seeds have been tried after every batch
+        '''
+        if not is_square_size(size):
+            raise Exception("Size Error: It must follow 'size = 2^n + 1'")
+        iters = int(np.log2(size - 1))
+        if not 0 <= coarse_level <= iters:
+            raise Exception("Level Error: The coarse level must be between 0 and " + str(iters))
+        self.size = size
+        self.min_val = min_val
+        self.max_val = max_val
+        self.constraints = list(constraints)
+        self.roughness = roughness
+        self.coarse_level = coarse_level
+        self.border = border
+        self.dtype = dtype
+        self.workers = workers
+        self.batch = batch
+        self.calibration = calibration
+        self.margin = margin
+        self.observer = observer if observer is not None else NULL_OBSERVER
+        self.counters = collections.Counter()
+
+    def coarse_survivors(self, seeds):
+        '''
+        Generates the coarse levels of a batch of seeds and checks them
+        @param seeds: The seeds
+        @return: Returns the seeds that passed every constraint with its slack
+        '''
+        grids = batch_coarse_levels(seeds, self.size, self.min_val, self.max_val, self.coarse_level, self.border)
+        ok = np.ones(len(seeds), dtype=bool)
+        for constraint in self.constraints:
+            ok &= constraint.passes(grids, coarse=True)
+        return [seed for seed, passed in zip(seeds, ok) if passed]
+
+    def calibrate(self, results):
+        '''
+        Sets the slack of every constraint that doesn't have one from how far the statistics of the coarse levels
+        of some seeds were from the ones of their full maps, a seed that is further off than any of them can still be missed
+        @param results: The results of refine_candidate for the seeds
+        '''
+        seeds = [result[0] for result in results]
+        grids = batch_coarse_levels(seeds, self.size, self.min_val, self.max_val, self.coarse_level, self.border)
+        for index, constraint in enumerate(self.constraints):
+            if constraint.slack is None:
+                full = np.array([result[3][index] for result in results])
+                constraint.slack = self.margin * float(np.max(np.abs(constraint.statistic(grids) - full)))
+
+    def search(self, seeds, count=1):
+        '''
+        Looks through seeds in order for maps that meet every constraint
+        @param seeds: The seeds to try, any iterable of ints like range(100000)
+        @param count: How many maps to find before stopping, None to try every seed
+        @return: Returns a list of (seed, map) in the order of the seeds
+        '''
+        found = []
+        args = (self.size, self.min_val, self.max_val, self.roughness, self.border, self.dtype, self.constraints)
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        pending = collections.deque()
+        total = len(seeds) if hasattr(seeds, '__len__') else None
+        seeds = iter(seeds)
+        start = time.perf_counter()
+
+        def take(result):
+            seed, ok, output, values = result
+            self.counters['refined'] += 1
+            if ok:
+                self.counters['accepted'] += 1
+                found.append((seed, output))
+
+        try:
+            if any(constraint.slack is None for constraint in self.constraints):
+                sample = [seed for _, seed in zip(range(max(1, self.calibration)), seeds)]
+                if pool is None:
+                    results = [refine_candidate(seed, *args) for seed in sample]
+                else:
+                    results = list(pool.map(refine_candidate, sample, *[[arg] * len(sample) for arg in args]))
+                self.calibrate(results)
+                self.counters['tried'] += len(sample)
+                for result in results:
+                    take(result)
+            while count is None or len(found) < count:
+                chunk = [seed for _, seed in zip(range(self.batch), seeds)]
+                if not chunk:
+                    break
+                survivors = self.coarse_survivors(chunk)
+                self.counters['tried'] += len(chunk)
+                self.counters['rejected_early'] += len(chunk) - len(survivors)
+                for seed in survivors:
+                    if count is not None and len(found) >= count:
+                        break
+                    if pool is None:
+                        take(refine_candidate(seed, *args))
+                        continue
+                    pending.append(pool.submit(refine_candidate, seed, *args))
+                    # The results are taken in seed order, only a few maps are in flight at once
+                    while len(pending) > 2 * self.workers:
+                        take(pending.popleft().result())
+                self.observer.progress("seed_search", self.counters['tried'], total if total is not None else self.counters['tried'])
+            while pending and (count is None or len(found) < count):
+                take(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+            if pool is not None:
+                pool.shutdown()
+        self.counters['seconds'] += time.perf_counter() - start
+        return found if count is None else found[:count]
+
+if __name__ == '__main__':
+    constraints = [WaterFraction(100, at_least=.4), Peak(at_least=200), CornerBasins(20)]
+    search = SeedSearch(513, 0, 255, constraints)
+    matches = search.search(range(100000), count=1)
+    print("Searched", dict(search.counters))
+    for seed, output in matches:
+        display_image("Seed " + str(seed), quantize(output, 0, 255))
@@ -1,12 +1,22 @@
 from general_functions import *
+from gradient_noise import GradientNoise
 import numpy as np
-import random
 
-def perlin(mag, influence):
-    return (mean(influence) + random.uniform(-mag//2, mag//2)) / 2
+def perlin(mag, influence, draws):
+    return (mean(influence) + draws.uniform(-mag//2, mag//2)) / 2
     
-def generate2d(size, seed, mag):
-    arr = np.zeros((size, size))
+def generate2d_loop(size, seed, mag, rng=None, dtype=np.float64):
+    '''
+    Generates a 2d noise field by averaging every cell with its neighbours and some jitter, one cell at a time
+    @param size: The square size of the field
+    @param seed: The starting value of the top left cells
+    @param mag: The magnitude of the jitter
+    @param rng: A seed or numpy Generator for the jitter, every call gets its own random number generator
+    @param dtype: The dtype of the field, np.float32 halves the memory
+    @return: Returns the field
+    '''
+    draws = RandomBlock(make_rng(rng))
+    arr = np.zeros((size, size), dtype=dtype)
     for v in range(size):
         for u in range(size):
             if u == 0 and v == 0:
@@ -16,10 +26,86 @@ def generate2d(size, seed, mag):
                 arr[v+1][u+1] = seed
             else:
                 influence = get_influence(arr, u, v)
-                val = perlin(mag, influence)
+                val = perlin(mag, influence, draws)
                 arr[v][u] = val
     return arr
                 
+def generate2d(size, seed, mag, rng=None, dtype=np.float64):
+    '''
+    Generates the same kind of field as generate2d_loop one anti-diagonal at a time.
+    When a cell is reached its left and top neighbours are done and its right and bottom ones are still zero,
+    so every cell on an anti-diagonal only depends on the one before it and they can all be done at once
+    @param size: The square size of the field
+    @param seed: The starting value of the top left cells
+    @param mag: The magnitude of the jitter
+    @param rng: A seed or numpy Generator for the jitter, every call gets its own random number generator
+    @param dtype: The dtype of the field, np.float32 halves the memory
+    @return: Returns the field
+    '''
+    rng = make_rng(rng)
+    arr = np.zeros((size, size), dtype=dtype)
+    arr[0, 0] = seed
+    if size == 1:
+        return arr
+    flat = arr.ravel()
+    
+    for k in range(1, 2 * size - 1):
+        # Every cell with v + u == k
+        v = np.arange(max(0, k - (size - 1)), min(k, size - 1) + 1)
+        u = k - v
+        idx = v * size + u
+        has_left = u > 0
+        has_up = v > 0
+        
+        # The neighbours outside of the field aren't counted, the ones to the right/bottom count as zeros
+        count = has_left.astype(np.int8) + has_up + (u < size - 1) + (v < size - 1)
+        total = np.where(has_left, flat[idx - has_left], 0)
+        total += np.where(has_up, flat[idx - size * has_up], 0)
+        
+        # The top left cells start out as the seed, cell (1, 1) is still the seed when (0, 1) and (1, 0) are calculated
+        if k == 1:
+            total += seed
+        
+        total /= count
+        total += rng.uniform(-mag//2, mag//2, size=total.shape)
+        total /= 2
+        flat[idx] = total
+    return arr
+    
+class SemiRandomNoise(BaseGenerator):
+    
+    def __init__(self, size, value, mag, seed=None, dtype=np.float64, cache=None):
+        '''
+        The field from generate2d behind the shared generator API, it is generated the first time the output is asked for
+        @param size: The square size of the field
+        @param value: The starting value of the top left cells
+        @param mag: The magnitude of the jitter
+        @param seed: The seed for the jitter
+        @param dtype: The dtype of the field
+        @param cache: An OutputCache to take the field from when it was generated before, None to always generate
+        '''
+        BaseGenerator.__init__(self, seed, {'size': size, 'value': value, 'mag': mag, 'dtype': np.dtype(dtype).str}, cache)
+        self.size = size
+        self.value = value
+        self.mag = mag
+        self.dtype = dtype
+        
+    def build(self):
+        return generate2d(self.size, self.value, self.mag, self.seed, self.dtype)
+    
+def gradient2d(size, seed, scale, octaves=6, lacunarity=2.0, gain=0.5):
+    '''
+    Generates a 2d field of real gradient noise (Perlin with fBm octaves) instead of neighbour averaging
+    @param size: The square size of the field
+    @param seed: The seed for the noise
+    @param scale: The size of a cell in noise coordinates, smaller is smoother
+    @param octaves: How many layers of noise to add up
+    @param lacunarity: How much the frequency grows each octave
+    @param gain: How much the amplitude shrinks each octave
+    @return: Returns the field, roughly in [-1, 1]
+    '''
+    return GradientNoise(seed).sample_grid(0, 0, size, size, scale, octaves, lacunarity, gain)
+                
 def get_influence(arr, u, v):
     influence = []
     if u-1 >= 0:
@@ -42,23 +128,18 @@ def get_normalized_color_value(intensity, min_limit, max_limit):
     @param max_limit: The maximum value for the intensities
     @return: Returns the color value for the given intensity
     '''
-    min_max_difference = max_limit - min_limit
-    intensity_cropped_by_max = np.where(intensity > max_limit, max_limit, intensity)
-    intensity_cropped_by_min = np.where(intensity_cropped_by_max < min_limit, min_limit, intensity_cropped_by_max)
-    intensity_cropped_zero_shifted = intensity_cropped_by_min - min_limit
-    intensity_normalized = intensity_cropped_zero_shifted * 255 / min_max_difference
-    return intensity_normalized.astype(np.uint8)
+    return quantize(intensity, min_limit, max_limit)
     
-def get_normalized(arr, min_lim, max_lim):
+def get_normalized(arr, min_lim, max_lim, dtype=np.uint8, out=None):
     '''
     Gets the normalized output array
     @param min_lim: The minimum value of the normalized range
     @param max_lim: The maximum value of the normalized range
+    @param dtype: The integer dtype of the normalized array, np.uint8 or np.uint16
+    @param out: An optional array to write the normalized values into instead of allocating one
     @return: Returns the normalized array
     '''
-    normalized = np.zeros_like(arr, dtype=np.uint8)
-    normalized[0:,0:] = get_normalized_color_value(arr[0:,0:], min_lim, max_lim)
-    return normalized
+    return quantize(arr, min_lim, max_lim, dtype, out)
         
 if __name__ == '__main__':
     arr = generate2d(1000, 100, 255)
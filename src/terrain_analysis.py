@@ -0,0 +1,200 @@
+from __future__ import print_function
+
+from general_functions import *
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import time
+import os
+
+# Every product analyze_terrain can make
+PRODUCTS = ('height', 'normals', 'slope', 'aspect', 'biome', 'colour')
+
+# How many rows of the map are analyzed at a time, every block also reads the row above and below it
+ANALYSIS_CHUNK_ROWS = 128
+
+# The biomes in the order they are checked, a point gets the first one it is under both limits of.
+# Every biome is (index, name, highest height from 0 to 1 of the map's range, steepest slope in degrees, BGR colour)
+DEFAULT_BIOMES = (
+    (0, 'water', .30, 90, (140, 60, 20)),
+    (1, 'beach', .34, 20, (150, 210, 230)),
+    (2, 'grass', .60, 25, (60, 170, 80)),
+    (3, 'forest', .75, 35, (40, 110, 40)),
+    (4, 'rock', .90, 90, (110, 110, 120)),
+    (5, 'snow', 1.0, 90, (245, 245, 250)),
+)
+
+def product_shapes(shape):
+    '''
+    @param shape: The (rows, columns) of the heightmap
+    @return: Returns a dict of the shape and dtype of every product
+    '''
+    rows, cols = shape
+    return {
+        'height': ((rows, cols), np.uint8),
+        'normals': ((rows, cols, 3), np.float32),
+        'slope': ((rows, cols), np.float32),
+        'aspect': ((rows, cols), np.float32),
+        'biome': ((rows, cols), np.uint8),
+        'colour': ((rows, cols, 3), np.uint8),
+    }
+
+def allocate_products(shape, products=PRODUCTS, height_dtype=np.uint8):
+    '''
+    Allocates the arrays analyze_terrain writes into, make them yourself (like memmaps) to put them somewhere else
+    @param shape: The (rows, columns) of the heightmap
+    @param products: The names of the products to allocate
+    @param height_dtype: The integer dtype of the quantized heights
+    @return: Returns a dict from every name to its empty array
+    '''
+    shapes = product_shapes(shape)
+    out = {}
+    for name in products:
+        if name not in shapes:
+            raise Exception("Product Error: There is no product named '%s', they are %s" % (name, ', '.join(PRODUCTS)))
+        product_shape, dtype = shapes[name]
+        out[name] = np.empty(product_shape, dtype=height_dtype if name == 'height' else dtype)
+    return out
+
+def analyze_block(heights, out, r0, r1, min_limit, max_limit, cell_size, z_scale, biomes, colours):
+    '''
+    Makes every product for rows r0 to r1, the heights are read once into a float32 block with a row of halo
+    on each side and the derived products are worked out from that block while it is still in cache.
+    The quantized heights are made from the rows of the map in its own dtype so they match quantize
+    @param heights: The heightmap
+    @param out: The dict of product arrays to write rows r0 to r1 of
+    @param r0: The first row
+    @param r1: The row after the last one
+    @param min_limit: The height that is 0 in the quantized heights and the biomes
+    @param max_limit: The height that is the top of the quantized heights and 1 for the biomes
+    @param cell_size: The distance between two points of the map
+    @param z_scale: What the heights are multiplied by before the slopes are worked out
+    @param biomes: The biome table, see DEFAULT_BIOMES
+    @param colours: The (biomes, 3) uint8 colours of the biomes by index
+    '''
+    rows, cols = heights.shape
+    top, bottom = max(r0 - 1, 0), min(r1 + 1, rows)
+    block = np.array(heights[top:bottom], dtype=np.float32)
+    lo, hi = r0 - top, r0 - top + (r1 - r0)
+    center = block[lo:hi]
+
+    # Central differences, the sides of the map only have one neighbour so the step there is one point instead of two
+    dx = np.empty((r1 - r0, cols), dtype=np.float32)
+    if cols > 1:
+        np.subtract(center[:, 2:], center[:, :-2], out=dx[:, 1:-1])
+        dx[:, 1:-1] *= .5
+        np.subtract(center[:, 1], center[:, 0], out=dx[:, 0])
+        np.subtract(center[:, -1], center[:, -2], out=dx[:, -1])
+    else:
+        dx[...] = 0
+    up = block[lo - 1:hi - 1] if r0 > 0 else np.concatenate((block[:1], block[:hi - 1]))
+    down = block[lo + 1:hi + 1] if r1 < rows else np.concatenate((block[lo + 1:hi], block[-1:]))
+    dy = np.subtract(down, up)
+    # Rows that only had one neighbour
+    steps = np.full((r1 - r0, 1), .5, dtype=np.float32)
+    if r0 == 0:
+        steps[0] = 1
+    if r1 == rows:
+        steps[-1] = 1
+    if rows == 1:
+        steps[...] = 0
+    dy *= steps
+    scale = z_scale / cell_size
+    dx *= scale
+    dy *= scale
+
+    if 'normals' in out:
+        normals = out['normals'][r0:r1]
+        length = np.sqrt(dx * dx + dy * dy + 1)
+        np.divide(-dx, length, out=normals[..., 0])
+        np.divide(-dy, length, out=normals[..., 1])
+        np.divide(1, length, out=normals[..., 2])
+
+    slope = None
+    if 'slope' in out or 'biome' in out or 'colour' in out:
+        slope = out['slope'][r0:r1] if 'slope' in out else np.empty((r1 - r0, cols), dtype=np.float32)
+        np.hypot(dx, dy, out=slope)
+        np.arctan(slope, out=slope)
+        np.degrees(slope, out=slope)
+
+    if 'aspect' in out:
+        # The compass direction downhill faces, clockwise from the top of the map
+        aspect = out['aspect'][r0:r1]
+        np.arctan2(-dx, dy, out=aspect)
+        np.degrees(aspect, out=aspect)
+        aspect %= 360
+
+    if 'height' in out:
+        # Quantized from the map itself, the float32 block would round some float64 heights across a step
+        quantize(heights[r0:r1], min_limit, max_limit, out['height'].dtype, out['height'][r0:r1], r1 - r0)
+
+    if 'biome' in out or 'colour' in out:
+        # The heights of the block from 0 to 1, reusing the block since the gradients are done
+        level = center
+        level -= min_limit
+        if max_limit != min_limit:
+            level /= (max_limit - min_limit)
+        biome = out['biome'][r0:r1] if 'biome' in out else np.empty((r1 - r0, cols), dtype=np.uint8)
+        # Checked backwards so the first biome that fits is the one left
+        biome[...] = biomes[-1][0]
+        for index, name, max_height, max_slope, colour in reversed(biomes[:-1]):
+            biome[(level <= max_height) & (slope <= max_slope)] = index
+        if 'colour' in out:
+            np.take(colours, biome, axis=0, out=out['colour'][r0:r1])
+
+def analyze_terrain(heights, min_limit=None, max_limit=None, products=PRODUCTS, out=None, cell_size=1.0, z_scale=1.0,
+                    biomes=DEFAULT_BIOMES, height_dtype=np.uint8, threads=None, chunk_rows=ANALYSIS_CHUNK_ROWS):
+    '''
+    Makes the derived maps of a heightmap in one pass over it: the quantized heights, the surface normals,
+    the slope and aspect in degrees and the biome index and colour of every point.
+    The map is split into blocks of rows that are done by a pool of threads, each block is read once and every
+    product is written straight into the output arrays, so the only temporaries are a few block sized ones per thread
+    @param heights: The 2D heightmap, like a generator's output or an np.memmap
+    @param min_limit: The height that is 0 in the quantized heights and the biomes, the minimum of heights if None
+    @param max_limit: The height that is the top of the quantized heights and 1 for the biomes, the maximum if None.
+                      Finding either of them takes a pass over the map of its own
+    @param products: The names of the products to make, see PRODUCTS
+    @param out: A dict of arrays to write the products into, the ones that aren't in it are allocated
+    @param cell_size: The distance between two points of the map
+    @param z_scale: What the heights are multiplied by before the slopes are worked out
+    @param biomes: The biome table, see DEFAULT_BIOMES, the last biome is the one for points that fit no other
+    @param height_dtype: The integer dtype of the quantized heights
+    @param threads: How many threads to use, defaults to the number of cores
+    @param chunk_rows: How many rows go in a block
+    @return: Returns the dict of products
+    '''
+    if heights.ndim != 2:
+        raise Exception("Analysis Error: The heightmap has to be 2D")
+    if min_limit is None or max_limit is None:
+        low, high = find_min_max(heights)
+        min_limit = float(low) if min_limit is None else min_limit
+        max_limit = float(high) if max_limit is None else max_limit
+    out = dict(out) if out is not None else {}
+    missing = [name for name in products if name not in out]
+    out.update(allocate_products(heights.shape, missing, height_dtype))
+    shapes = product_shapes(heights.shape)
+    for name, arr in out.items():
+        if name not in shapes:
+            raise Exception("Product Error: There is no product named '%s', they are %s" % (name, ', '.join(PRODUCTS)))
+        if arr.shape != shapes[name][0]:
+            raise Exception("Product Error: The %s array has shape %s but needs %s" % (name, arr.shape, shapes[name][0]))
+    colours = np.zeros((max(biome[0] for biome in biomes) + 1, 3), dtype=np.uint8)
+    for index, name, max_height, max_slope, colour in biomes:
+        colours[index] = colour
+
+    rows = heights.shape[0]
+    threads = threads if threads is not None else (os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(analyze_block, heights, out, r0, min(r0 + chunk_rows, rows), min_limit, max_limit,
+                               cell_size, z_scale, biomes, colours)
+                   for r0 in range(0, rows, chunk_rows)]
+        for future in futures:
+            future.result()
+    return out
+
+if __name__ == '__main__':
+    from diamond_square_algo_alt import DiamondSquareGenerator
+    heights = DiamondSquareGenerator(1, 2049, 0, 255, .4, engine='numpy', dtype=np.float32).output
+    start = time.time()
+    products = analyze_terrain(heights, z_scale=.25)
+    print("Analyzed a 2049 x 2049 map in", time.time() - start, "seconds")
+    display_image("Biomes", products['colour'])
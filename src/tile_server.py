@@ -0,0 +1,302 @@
+from __future__ import print_function
+
+from general_functions import *
+from tiled_terrain import generate_tile
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import argparse
+import asyncio
+import json
+import time
+import io
+import re
+
+# The paths the server answers, tiles can be negative since the world goes on forever
+TILE_PATH = re.compile(r'^/tiles/(-?\d+)/(-?\d+)\.(npy|png)$')
+
+# How many of the latest request latencies the percentiles are taken over
+LATENCY_WINDOW = 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def encode_tile(tile, fmt, min_val, max_val):
+    '''
+    Turns a tile into the body of a response
+    @param tile: The height map of the tile
+    @param fmt: 'npy' for the raw values or 'png' for a 16 bit grayscale image from min_val to max_val
+    @return: Returns the bytes and their content type
+    '''
+    if fmt == 'npy':
+        buf = io.BytesIO()
+        np.save(buf, tile)
+        return buf.getvalue(), 'application/octet-stream'
+    ok, encoded = cv2.imencode('.png', quantize(tile, min_val, max_val, np.uint16))
+    if not ok:
+        raise Exception("Server Error: The tile couldn't be encoded")
+    return encoded.tobytes(), 'image/png'
+
+class TileServer():
+
+    def __init__(self, world_seed, tile_size=257, min_val=0, max_val=255, roughness=.4, workers=None, max_bytes=1 << 28, executor=None, dtype=np.float64):
+        '''
+        Constructor for the TileServer class, serves the tiles of a TiledTerrain over HTTP and generates them on demand
+        Tiles are generated in a process pool so the event loop keeps answering while they are made, requests for a
+        tile that is already being made wait on the same job, and the tiles that were served last are kept in an
+        OutputCache until they take up more than max_bytes
+        @param world_seed: The seed every tile seed is derived from
+        @param tile_size: The square size of a tile, it must follow 'size = 2^n + 1'
+        @param min_val: The minimum value of the height map
+        @param max_val: The maximum value of the height map
+        @param roughness: Value between 1 and 0 reflects the smoothness between cells
+        @param workers: How many processes generate tiles, defaults to the number of cores
+        @param max_bytes: The most bytes of tiles to keep in memory
+        @param executor: An executor to generate the tiles in instead of a new process pool, it isn't shut down by the server
+        @param dtype: The dtype of the tiles, np.float32 fits twice as many of them in the cache
+        '''
+        self.world_seed = world_seed
+        self.tile_size = tile_size
+        self.min_val = min_val
+        self.max_val = max_val
+        self.roughness = roughness
+        self.dtype = dtype
+        self.workers = workers
+        self.cache = OutputCache(max_bytes)
+        self.executor = executor
+        self._own_executor = executor is None
+        self._server = None
+
+        # The tiles being generated right now, every request for one of them waits on its future
+        self._jobs = {}
+
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.generation_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.max_queue_depth = 0
+
+    def tile_key(self, tx, ty):
+        '''
+        @return: Returns the cache key of a tile
+        '''
+        return param_key('tile', {'world_seed': self.world_seed, 'tile_size': self.tile_size, 'min_val': self.min_val,
+                                  'max_val': self.max_val, 'roughness': self.roughness, 'dtype': np.dtype(self.dtype).str, 'tx': tx, 'ty': ty})
+
+    async def get_tile(self, tx, ty):
+        '''
+        Gets a tile from the cache, or from the job that is already making it, or starts a new job for it
+        @param tx: The x coordinate of the tile
+        @param ty: The y coordinate of the tile
+        @return: Returns the height map of the tile
+        '''
+        key = self.tile_key(tx, ty)
+        tile = self.cache.get(key)
+        if tile is not None:
+            self.counters['hits'] += 1
+            return tile
+        job = self._jobs.get(key)
+        if job is not None:
+            self.counters['coalesced'] += 1
+        else:
+            self.counters['misses'] += 1
+            job = asyncio.ensure_future(self._generate(key, tx, ty))
+            self._jobs[key] = job
+            self.max_queue_depth = max(self.max_queue_depth, len(self._jobs))
+        # Shielded so a client that goes away doesn't cancel the job for everyone else waiting on it
+        return await asyncio.shield(job)
+
+    async def _generate(self, key, tx, ty):
+        '''
+        Generates a tile in the executor and puts it in the cache
+        '''
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            tile = await loop.run_in_executor(self.executor, generate_tile, self.world_seed, tx, ty, self.tile_size,
+                                              self.min_val, self.max_val, self.roughness, self.dtype)
+            self.cache.put(key, tile)
+            self.counters['generated'] += 1
+            self.generation_times.append(time.perf_counter() - start)
+            return tile
+        finally:
+            del self._jobs[key]
+
+    def metrics(self):
+        '''
+        @return: Returns a dict with the request counts, the cache use, how many tiles are being generated and the
+                 latency percentiles in seconds over the latest requests
+        '''
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p90, p99 = np.percentile(np.array(values), [50, 90, 99])
+            return {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values)}
+
+        counters = dict(self.counters)
+        return {
+            'requests': counters.get('requests', 0),
+            'errors': counters.get('errors', 0),
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'coalesced': counters.get('coalesced', 0),
+            'generated': counters.get('generated', 0),
+            'queue_depth': len(self._jobs),
+            'max_queue_depth': self.max_queue_depth,
+            'cache_bytes': self.cache.nbytes,
+            'cache_max_bytes': self.cache.max_bytes,
+            'latency': percentiles(self.latencies),
+            'generation_time': percentiles(self.generation_times),
+        }
+
+    async def route(self, method, path):
+        '''
+        Answers one request
+        @param method: The HTTP method
+        @param path: The path of the request without the query
+        @return: Returns the status code, the content type and the body
+        '''
+        if method != 'GET':
+            return 405, 'text/plain', b'Only GET is supported\n'
+        if path == '/metrics':
+            return 200, 'application/json', json.dumps(self.metrics()).encode('utf-8')
+        match = TILE_PATH.match(path)
+        if match is None:
+            return 404, 'text/plain', b'Not found, tiles are at /tiles/<x>/<y>.npy or .png\n'
+        tile = await self.get_tile(int(match.group(1)), int(match.group(2)))
+        body, content_type = encode_tile(tile, match.group(3), self.min_val, self.max_val)
+        return 200, content_type, body
+
+    async def handle(self, reader, writer):
+        '''
+        Serves the requests of one connection, it is kept open until the client closes it or asks to close it
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                start = time.perf_counter()
+                self.counters['requests'] += 1
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, content_type, body = 400, 'text/plain', b'Bad request line\n'
+                else:
+                    try:
+                        status, content_type, body = await self.route(parts[0], parts[1].split('?')[0])
+                    except Exception as e:
+                        status, content_type, body = 500, 'text/plain', (str(e) + "\n").encode('utf-8')
+                if status != 200:
+                    self.counters['errors'] += 1
+
+                close = headers.get('connection', '').lower() == 'close' or (len(parts) == 3 and parts[2] == 'HTTP/1.0')
+                head = "HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" % (
+                    status, HTTP_REASONS[status], content_type, len(body), 'close' if close else 'keep-alive')
+                writer.write(head.encode('latin-1') + body)
+                await writer.drain()
+                self.latencies.append(time.perf_counter() - start)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=0):
+        '''
+        Starts listening, the server runs in the current event loop until close is called
+        @param host: The address to listen on
+        @param port: The port to listen on, 0 picks a free one
+        @return: Returns the (host, port) the server is listening on
+        '''
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        '''
+        Stops listening and shuts down the process pool if the server made it
+        '''
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._own_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+async def fetch(host, port, path):
+    '''
+    A small client for the server, made for tests and scripts
+    @param host: The address of the server
+    @param port: The port of the server
+    @param path: The path to get, like '/tiles/0/0.npy' or '/metrics'
+    @return: Returns the status code, the headers and the body
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n" % (path, host)).encode('latin-1'))
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers, body
+    finally:
+        writer.close()
+
+async def fetch_tile(host, port, tx, ty):
+    '''
+    Gets the height map of a tile from the server
+    @return: Returns the tile
+    '''
+    status, headers, body = await fetch(host, port, "/tiles/%d/%d.npy" % (tx, ty))
+    if status != 200:
+        raise Exception("Server Error: " + body.decode('utf-8', 'replace').strip())
+    return np.load(io.BytesIO(body))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves the tiles of an endless Diamond Square world over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="The address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="The port to listen on")
+    parser.add_argument('--seed', type=int, default=0, help="The seed of the world")
+    parser.add_argument('--tile-size', type=int, default=257, help="The size of a tile, 2^n + 1")
+    parser.add_argument('--workers', type=int, help="How many processes generate tiles, the number of cores by default")
+    parser.add_argument('--cache-mb', type=int, default=256, help="How many megabytes of tiles to keep in memory")
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = TileServer(args.seed, args.tile_size, workers=args.workers, max_bytes=args.cache_mb << 20)
+        host, port = await server.start(args.host, args.port)
+        print("Serving tiles on http://%s:%d/tiles/<x>/<y>.png, metrics on /metrics" % (host, port))
+        try:
+            await server._server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    main()
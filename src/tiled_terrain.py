@@ -0,0 +1,133 @@
+from __future__ import print_function
+
+from general_functions import *
+from diamond_square_algo_alt import DiamondSquareGenerator
+from diamond_square_plan import get_level_plan
+import numpy as np
+import math
+
+# Keys mixed into the world seed so corners, edges and tiles all get independent streams
+CORNER_KEY = 0
+HORIZONTAL_EDGE_KEY = 1
+VERTICAL_EDGE_KEY = 2
+TILE_KEY = 3
+
+def corner_value(world_seed, cx, cy, min_val, max_val):
+    '''
+    Gets the value of a corner shared by the four tiles around it
+    @param world_seed: The seed of the whole world
+    @param cx: The x coordinate of the corner in tiles
+    @param cy: The y coordinate of the corner in tiles
+    @param min_val: The minimum value of the height map
+    @param max_val: The maximum value of the height map
+    @return: Returns the corner value
+    '''
+    rng = make_rng(derive_seed(world_seed, CORNER_KEY, cx, cy))
+    return rng.uniform(min_val, max_val)
+
+def edge_values(world_seed, key, x, y, size, min_val, max_val):
+    '''
+    Generates the values along an edge shared by two tiles with 1D midpoint displacement.
+    The edge only depends on the world seed and its own location so both tiles get the same values
+    @param world_seed: The seed of the whole world
+    @param key: HORIZONTAL_EDGE_KEY for an edge going right from (x, y), VERTICAL_EDGE_KEY for one going down
+    @param x: The x coordinate of the start of the edge in tiles
+    @param y: The y coordinate of the start of the edge in tiles
+    @param size: The size of a tile
+    @param min_val: The minimum value of the height map
+    @param max_val: The maximum value of the height map
+    @return: Returns the values along the edge
+    '''
+    if key == HORIZONTAL_EDGE_KEY:
+        end_x, end_y = x + 1, y
+    else:
+        end_x, end_y = x, y + 1
+
+    edge = np.zeros(size)
+    edge[0] = corner_value(world_seed, x, y, min_val, max_val)
+    edge[size-1] = corner_value(world_seed, end_x, end_y, min_val, max_val)
+
+    # Same levels and magnitudes as DiamondSquareGenerator, every midpoint is the mean of its two ends
+    rng = make_rng(derive_seed(world_seed, key, x, y))
+    iters = int(math.log(size - 1, 2))
+    for i in range(1, iters + 2):
+        plan = get_level_plan(size, i)
+        if plan.d == 0:
+            break
+        mag = max_val * (1 / (2*i) + .5)
+        mids = edge[plan.mid_slice]
+        mids[...] = (edge[plan.low_slice] + edge[plan.high_slice]) / 2
+        mids += rng.uniform(-mag, mag, size=mids.shape)
+    return edge
+
+def generate_tile(world_seed, tx, ty, size, min_val, max_val, roughness, dtype=np.float64):
+    '''
+    Generates a single tile of the world, it lines up with every neighbour no matter which order they are made in.
+    This is a module level function so it can be sent to process pools
+    @param world_seed: The seed of the whole world
+    @param tx: The x coordinate of the tile
+    @param ty: The y coordinate of the tile
+    @param size: The square size of a tile, tiles overlap by one row/column
+    @param min_val: The minimum value of the height map
+    @param max_val: The maximum value of the height map
+    @param roughness: Value between 1 and 0 reflects the smoothness between cells
+    @param dtype: The dtype of the tile, np.float32 halves the memory
+    @return: Returns the height map of the tile
+    '''
+    border = (edge_values(world_seed, HORIZONTAL_EDGE_KEY, tx, ty, size, min_val, max_val), # Top
+              edge_values(world_seed, HORIZONTAL_EDGE_KEY, tx, ty + 1, size, min_val, max_val), # Bottom
+              edge_values(world_seed, VERTICAL_EDGE_KEY, tx, ty, size, min_val, max_val), # Left
+              edge_values(world_seed, VERTICAL_EDGE_KEY, tx + 1, ty, size, min_val, max_val)) # Right
+    tile_seed = derive_seed(world_seed, TILE_KEY, tx, ty)
+    dsg = DiamondSquareGenerator(tile_seed, size, min_val, max_val, roughness, engine='numpy', border=border, dtype=dtype)
+    return dsg.output
+
+class TiledTerrain():
+
+    def __init__(self, world_seed, tile_size, min_val, max_val, roughness, dtype=np.float64):
+        '''
+        Constructor for the TiledTerrain class, an endless height map made out of diamond square tiles
+        @param world_seed: The seed every tile seed is derived from
+        @param tile_size: The square size of a tile, it must follow 'size = 2^n + 1'
+        @param min_val: The minimum value of the height map
+        @param max_val: The maximum value of the height map
+        @param roughness: Value between 1 and 0 reflects the smoothness between cells
+        @param dtype: The dtype of the tiles and regions, np.float32 halves the memory
+        '''
+        self.world_seed = world_seed
+        self.tile_size = tile_size
+        self.min_val = min_val
+        self.max_val = max_val
+        self.roughness = roughness
+        self.dtype = dtype
+
+    def get_tile(self, tx, ty):
+        '''
+        Gets the tile at the given tile coordinates
+        Neighbouring tiles share their edge row/column, the tile to the right starts on this tile's last column
+        @param tx: The x coordinate of the tile
+        @param ty: The y coordinate of the tile
+        @return: Returns the height map of the tile
+        '''
+        return generate_tile(self.world_seed, tx, ty, self.tile_size, self.min_val, self.max_val, self.roughness, self.dtype)
+
+    def get_region(self, tx, ty, width, height):
+        '''
+        Stitches a block of tiles together into one height map
+        @param tx: The x coordinate of the top left tile
+        @param ty: The y coordinate of the top left tile
+        @param width: How many tiles across
+        @param height: How many tiles down
+        @return: Returns the stitched height map
+        '''
+        step = self.tile_size - 1
+        region = np.zeros((height * step + 1, width * step + 1), dtype=self.dtype)
+        for y in range(height):
+            for x in range(width):
+                region[y*step:y*step + self.tile_size, x*step:x*step + self.tile_size] = self.get_tile(tx + x, ty + y)
+        return region
+
+if __name__ == '__main__':
+    terrain = TiledTerrain(1234, 129, 0, 255, .4)
+    region = terrain.get_region(-1, -1, 3, 3)
+    display_image("Tiles", np.clip(region, 0, 255).astype(np.uint8))
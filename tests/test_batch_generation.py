@@ -0,0 +1,12 @@
+import numpy as np
+
+from batch_generation import generate_batch
+from diamond_square_algo_alt import DiamondSquareGenerator
+
+def test_batch_matches_direct_generation():
+    specs = [(1, 65, 0, 255, .4), (2, (40, 30), 0, 255, .4)]
+    with generate_batch(specs, max_workers=2, dtype=np.float32) as result:
+        for (seed, size, min_val, max_val, roughness), output in zip(specs, result.maps):
+            direct = DiamondSquareGenerator(seed, size, min_val, max_val, roughness, engine='numpy', dtype=np.float32).output
+            assert output.dtype == np.float32
+            assert np.array_equal(output, direct)
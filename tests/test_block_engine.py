@@ -0,0 +1,66 @@
+import numpy as np
+
+from diamond_square_algo_alt import DiamondSquareGenerator
+from seed_search import batch_coarse_levels
+
+# Bigger than one noise block so the parallel engine splits the levels across workers
+SIZE = 257
+
+def make_border(size):
+    ramp = np.linspace(0, 50, size)
+    return (ramp, ramp[::-1].copy(), ramp, ramp[::-1].copy())
+
+def test_batch_coarse_levels_match_coarse_map():
+    seeds = [0, 1, 7]
+    grids = batch_coarse_levels(seeds, SIZE, 0, 255, 5)
+    for grid, seed in zip(grids, seeds):
+        coarse = DiamondSquareGenerator(seed, SIZE, 0, 255, .4, engine='block', lazy=True).coarse_map(5)
+        assert np.array_equal(grid, coarse)
+
+def test_batch_coarse_levels_match_coarse_map_with_border():
+    border = make_border(SIZE)
+    grids = batch_coarse_levels([3, 4], SIZE, 0, 255, 4, border)
+    for grid, seed in zip(grids, [3, 4]):
+        coarse = DiamondSquareGenerator(seed, SIZE, 0, 255, .4, engine='block', border=border, lazy=True).coarse_map(4)
+        assert np.array_equal(grid, coarse)
+
+def block_map(seed, workers=1, **kwargs):
+    return DiamondSquareGenerator(seed, SIZE, 0, 255, .4, engine='block', workers=workers, **kwargs).output
+
+def test_parallel_matches_one_worker():
+    one = block_map(11)
+    for workers in (2, 3):
+        assert np.array_equal(block_map(11, workers), one)
+
+def test_parallel_matches_one_worker_float32_and_border():
+    border = make_border(SIZE)
+    one = block_map(12, dtype=np.float32, border=border)
+    assert np.array_equal(block_map(12, 2, dtype=np.float32, border=border), one)
+
+def test_parallel_writes_memmap_store(tmp_path):
+    one = block_map(13)
+    store = block_map(13, 2, store=str(tmp_path / 'map.npy'))
+    assert isinstance(store, np.memmap)
+    assert np.array_equal(np.load(str(tmp_path / 'map.npy')), one)
+
+def test_refine_rect_matches_output():
+    gen = DiamondSquareGenerator(14, SIZE, 0, 255, .4, engine='block')
+    for level in (0, 3, 6):
+        coarse = gen.coarse_map(level)
+        for rect in ((10, 20, 100, 77), (0, 0, SIZE, SIZE), (200, 129, SIZE, 256)):
+            top, left, bottom, right = rect
+            assert np.array_equal(gen.refine(coarse, level, rect), gen.output[top:bottom, left:right])
+
+def test_refine_rect_matches_output_with_border():
+    border = make_border(SIZE)
+    gen = DiamondSquareGenerator(15, SIZE, 0, 255, .4, engine='block', border=border)
+    assert np.array_equal(gen.refine(gen.coarse_map(4), 4, (0, 30, 64, 200)), gen.output[0:64, 30:200])
+
+def test_refine_stop_level_matches_coarse_map():
+    gen = DiamondSquareGenerator(16, SIZE, 0, 255, .4, engine='block', lazy=True)
+    assert np.array_equal(gen.refine(gen.coarse_map(2), 2, stop_level=5), gen.coarse_map(5))
+
+def test_parallel_fills_array_store():
+    store = np.empty((SIZE, SIZE))
+    assert block_map(17, 2, store=store) is store
+    assert np.array_equal(store, block_map(17))
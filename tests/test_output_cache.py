@@ -0,0 +1,19 @@
+import numpy as np
+
+from general_functions import OutputCache
+
+def test_put_keeps_a_copy():
+    cache = OutputCache(max_bytes=1 << 20)
+    arr = np.arange(16.)
+    cache.put('key', arr)
+    arr[0] = -1
+    assert cache.get('key')[0] == 0
+    assert cache.nbytes == arr.nbytes
+
+def test_put_too_big_memmap_only_saves_the_file(tmp_path):
+    mapped = np.lib.format.open_memmap(str(tmp_path / 'map.npy'), mode='w+', dtype=np.float64, shape=(64, 64))
+    mapped[...] = np.arange(64)
+    cache = OutputCache(max_bytes=1024, directory=str(tmp_path / 'cache'))
+    cache.put('key', mapped)
+    assert cache.nbytes == 0
+    assert np.array_equal(cache.get('key'), mapped)
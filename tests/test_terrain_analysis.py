@@ -0,0 +1,9 @@
+import numpy as np
+
+from general_functions import quantize
+from terrain_analysis import analyze_terrain
+
+def test_height_matches_quantize():
+    heights = np.cumsum(np.random.default_rng(0).random((300, 257)), axis=0)
+    products = analyze_terrain(heights, products=('height',), height_dtype=np.uint16, chunk_rows=37)
+    assert np.array_equal(products['height'], quantize(heights, dtype=np.uint16))
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from general_functions import PACKED, unpack_mask
+from random_stuff import TowerMaker, generate_towers
+
+@pytest.mark.parametrize('engine', ['loop', 'numpy'])
+def test_bool_and_packed_towers_match_uint8(engine):
+    tower = TowerMaker(64, 5, seed=3, engine=engine).output == 0
+    mask = TowerMaker(64, 5, seed=3, engine=engine, dtype=bool).output
+    packed = TowerMaker(64, 5, seed=3, engine=engine, dtype=PACKED).output
+    assert tower.sum() > 64
+    assert np.array_equal(mask, tower)
+    assert np.array_equal(unpack_mask(packed, 64), tower)
+
+def test_bool_batch_matches_uint8():
+    towers = generate_towers(3, 40, 5, seed=1) == 0
+    assert np.array_equal(generate_towers(3, 40, 5, seed=1, dtype=bool), towers)